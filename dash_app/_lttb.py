@@ -0,0 +1,79 @@
+# dash_app/_lttb.py
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba は任意依存（pip install .[jit]）。無ければ NumPy 版を使う
+    njit = None
+
+def _bucket_edges(n: int, n_out: int) -> np.ndarray:
+    """先頭・末尾を除いた n-2 点を n_out-2 個のバケットに分割する境界（両実装で同じものを使う）"""
+    return np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+
+def _lttb_numpy(x: np.ndarray, y: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    n = len(x)
+    n_out = len(edges) + 1
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # 次バケットの重心（最後のバケットでは末尾の点）
+        nhi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[hi:nhi].mean()
+        avg_y = y[hi:nhi].mean()
+        # 前回採用点 a・次バケット重心と作る三角形の面積が最大の点を採用
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    return idx
+
+def _lttb_loop(x: np.ndarray, y: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """_lttb_numpy と同じアルゴリズム・同じバケット境界をスカラーループで書いたもの（numba でコンパイルして使う）"""
+    n = x.shape[0]
+    n_out = edges.shape[0] + 1
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0] = 0
+    idx[n_out - 1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        lo = edges[i]
+        hi = edges[i + 1]
+        nhi = edges[i + 2] if i + 2 < edges.shape[0] else n
+        avg_x = 0.0
+        avg_y = 0.0
+        for j in range(hi, nhi):
+            avg_x += x[j]
+            avg_y += y[j]
+        avg_x /= nhi - hi
+        avg_y /= nhi - hi
+
+        best, best_area = lo, -1.0
+        for j in range(lo, hi):
+            area = abs((x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a]))
+            if area > best_area:
+                best, best_area = j, area
+        a = best
+        idx[i + 1] = a
+    return idx
+
+if njit is not None:
+    # LTTB は前回の採用点に依存する逐次処理なので parallel は使わない
+    _lttb_impl = njit(cache=True)(_lttb_loop)
+    _lttb_impl(np.arange(8, dtype=np.float64), np.zeros(8), _bucket_edges(8, 4))  # import 時にコンパイルを済ませておく
+else:
+    _lttb_impl = _lttb_numpy
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets で系列を n_out 点に間引き、採用した点のインデックスを返す。
+    x は昇順の数値配列（datetime は int64 に変換して渡す）。先頭・末尾の点は必ず残す。
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    y = np.ascontiguousarray(y, dtype=np.float64)
+    return _lttb_impl(x, y, _bucket_edges(n, n_out))
@@ -2,6 +2,7 @@
 import os
 import dash
 import dash_bootstrap_components as dbc
+import plotly.io as pio
 from flask_caching import Cache
 from pathlib import Path
 
@@ -12,6 +13,13 @@ from dash_app.callbacks import register_callbacks
 DB_PATH = os.getenv("DB_PATH", str(Path(__file__).resolve().parents[1] / "data/db/wait_times.db"))
 MAP_JSON = os.getenv("MAP_JSON", str(Path(__file__).resolve().parents[1] / "data/out/map_latest.json"))
 PORT = int(os.getenv("PORT", "8050"))
+# 複数ワーカー運用時は CACHE_TYPE=FileSystemCache（CACHE_DIR）や RedisCache（CACHE_REDIS_URL）に切替
+CACHE_TYPE = os.getenv("CACHE_TYPE", "SimpleCache")
+# DB をイメージに焼き込み、起動中に書き換えない運用なら DB_IMMUTABLE=1（SQLite のロック・変更検知を省略）
+DB_IMMUTABLE = os.getenv("DB_IMMUTABLE", "0") == "1"
+
+# 図のシリアライズ（コールバック応答）に orjson を明示的に使う
+pio.json.config.default_engine = "orjson"
 
 # Dash アプリ初期化
 app = dash.Dash(
@@ -22,14 +30,19 @@ app = dash.Dash(
 )
 server = app.server
 
-# シンプルキャッシュ（60秒）
-cache = Cache(app.server, config={"CACHE_TYPE": "SimpleCache", "CACHE_DEFAULT_TIMEOUT": 60})
+# キャッシュ（60秒）。既定はプロセス内の SimpleCache
+cache_config = {"CACHE_TYPE": CACHE_TYPE, "CACHE_DEFAULT_TIMEOUT": 60}
+if CACHE_TYPE == "FileSystemCache":
+    cache_config["CACHE_DIR"] = os.getenv("CACHE_DIR", "/tmp/dash_cache")
+elif CACHE_TYPE == "RedisCache":
+    cache_config["CACHE_REDIS_URL"] = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+cache = Cache(app.server, config=cache_config)
 
 # レイアウト（DFは渡さない前提）
 app.layout = create_layout()
 
 # コールバック登録（新シグネチャ）
-register_callbacks(app, DB_PATH, MAP_JSON, cache)
+register_callbacks(app, DB_PATH, MAP_JSON, cache, db_immutable=DB_IMMUTABLE)
 
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=PORT, use_reloader=True)
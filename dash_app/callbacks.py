@@ -1,141 +1,201 @@
-from dash import Input, Output
+from dash import Input, Output, State, no_update
+from dash.exceptions import PreventUpdate
 import plotly.express as px
 import plotly.graph_objects as go
-import pandas as pd
-import json, re
+import numpy as np
+import hashlib, orjson, os
 
 from dash_app.data_access import (
-    open_conn, get_pavilion_options, get_overall_avg,
-    get_weekday_dispersion, get_hour_dispersion, get_ranking,
-    get_latest_rows, get_time_series, get_weekday_hour, get_weekday_bar,
-    get_last_updated
+    get_conn, check_schema, ensure_indexes, get_pavilion_options, get_ranking,
+    get_latest_rows, get_time_series, get_range_bundle, get_last_updated,
+    get_latest_feature_collection
 )
+from dash_app._lttb import lttb
 
 WEEKDAY_ORDER = ["月曜日","火曜日","水曜日","木曜日","金曜日","土曜日","日曜日"]
+HOUR_LABELS = [f"{h:02d}:00" for h in range(24)]
+TS_MAX_POINTS = 500  # 時系列1本あたりブラウザへ送る最大点数（LTTB で間引く）
 
 def _range_to_days(key: str):
     return {"7d":7, "30d":30, "all":None}.get(key or "7d", 7)
 
-def _sorted_hours(hours):
-    import re
-    def h2i(h):
-        m = re.match(r"(\d{1,2}):00", str(h))
-        return int(m.group(1)) if m else 0
-    return sorted(set(hours), key=h2i)
+# 地図用 GeoJSON のプロセス内キャッシュ: path -> (mtime, data)
+# ファイルの mtime が変わった時だけ読み直す（タプルごと差し替えるのでスレッド間でも不整合にならない）
+_GEO_CACHE: dict = {}
+
+def _read_geojson(path: str):
+    mtime = os.stat(path).st_mtime
+    cached = _GEO_CACHE.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = _GEO_CACHE[path] = (mtime, get_latest_feature_collection(path))
+    return cached
+
+def register_callbacks(app, db_path: str, map_json_path: str, cache, db_immutable: bool = False):
+
+    # 接続は data_access.get_conn のスレッド単位プールから取得（コールバック毎に開き直さない）
+    # コールバック側は読み取り専用。db_immutable=True なら immutable=1 でロックも省く
+    def _ro():
+        return get_conn(db_path, read_only=True, immutable=db_immutable)
+
+    # 集計用インデックスを起動時に1回だけ用意（書き込み可能な接続で）
+    # その前に読み取り専用で必要な列・表を確認し、足りなければ DB に触れずに止める
+    check_schema(get_conn(db_path, read_only=True))
+    rw = get_conn(db_path, read_only=False)
+    ensure_indexes(rw)
+    if db_immutable:
+        # immutable 接続は -wal を読まないので、起動時の書き込みを本体ファイルへ反映しておく
+        rw.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    # ---- 集計結果のメモ化（60秒） ----
+    # 第1引数に DB の更新時刻を含め、ETL が書き込んだらキャッシュキーが変わるようにする。
+    # WAL 運用中は本体ファイルではなく -wal 側の mtime が動くため両方を見る。
+    def _db_version():
+        return max(os.path.getmtime(p) for p in (db_path, db_path + "-wal") if os.path.exists(p))
 
-def register_callbacks(app, db_path: str, map_json_path: str, cache):
+    @cache.memoize(timeout=60)
+    def _cached_pavilion_options(_version):
+        return get_pavilion_options(_ro())
+
+    @cache.memoize(timeout=60)
+    def _cached_range_bundle(_version, days):
+        return get_range_bundle(_ro(), days, top_n=20)
+
+    @cache.memoize(timeout=60)
+    def _cached_ranking(_version, days):
+        return get_ranking(_ro(), days, top_n=20)
+
+    @cache.memoize(timeout=60)
+    def _cached_latest_rows(_version, days):
+        return get_latest_rows(_ro(), days, limit=20)
+
+    @cache.memoize(timeout=60)
+    def _cached_time_series(_version, names, days):
+        return get_time_series(_ro(), list(names), days)
 
-    # ▼▼ ここを削除：con = open_conn(db_path) 使い回しはしない ▼▼
-    # con = open_conn(db_path)
+    @cache.memoize(timeout=60)
+    def _cached_last_updated(_version):
+        return get_last_updated(_ro())
 
     # パビリオン選択肢
     @app.callback(Output("dd-pavilion", "options"), Input("dd-range", "value"))
     def _init_pavilion_options(_):
-        with open_conn(db_path) as con:
-            return [{"label": n, "value": n} for n in get_pavilion_options(con)]
-
-    # KPI
-    @app.callback(
+        return [{"label": n, "value": n} for n in _cached_pavilion_options(_db_version())]
+
+    # dd-range 連動の集計（1回の SQL でまとめて agg-store へ）。最終更新時刻も同じ応答に載せる
+    # 内容のハッシュが前回と同じなら agg-store を更新せず、KPI・図の再計算/再描画を丸ごと省く
+    @app.callback(Output("agg-store","data"), Output("agg-hash","data"),
+                  Input("dd-range","value"), State("agg-hash","data"))
+    def _agg_bundle(range_key, last_hash):
+        version = _db_version()
+        bundle = {**_cached_range_bundle(version, _range_to_days(range_key)),
+                  "last_updated": _cached_last_updated(version)}
+        digest = hashlib.blake2b(orjson.dumps(bundle, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+        if digest == last_hash:
+            return no_update, no_update
+        return bundle, digest
+
+    # KPI / 最終更新は agg-store の値を整形するだけなのでブラウザ側で処理する（サーバー往復なし）
+    app.clientside_callback(
+        """
+        function(b) {
+            b = b || {};
+            var fmt = function(v) { return v == null ? "—" : Math.round(v).toLocaleString("ja-JP") + " 分"; };
+            return [fmt(b.overall_avg), fmt(b.weekday_disp), fmt(b.hour_disp)];
+        }
+        """,
         Output("card-avg","children"),
         Output("card-weekday5p","children"),
         Output("card-hour5p","children"),
-        Input("dd-range","value"),
+        Input("agg-store","data"),
+        prevent_initial_call=True,
+    )
+
+    # timestamp は JST の isoformat（例: 2026-02-01T14:20:48.607671+09:00）なので先頭を切り出して表示
+    app.clientside_callback(
+        r"""
+        function(b) {
+            var ts = (b || {}).last_updated;
+            if (!ts) { return "最終更新: —"; }
+            var m = /^(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2})/.exec(ts);
+            return "最終更新: " + (m ? m[1] + " " + m[2] : ts);
+        }
+        """,
+        Output("last-updated-text","children"),
+        Input("agg-store","data"),
+        prevent_initial_call=True,
     )
-    def _kpis(range_key):
-        days = _range_to_days(range_key)
-        with open_conn(db_path) as con:
-            avg = get_overall_avg(con, days)
-            wd  = get_weekday_dispersion(con, days)
-            hr  = get_hour_dispersion(con, days)
-        fmt = lambda v: f"{round(v):,} 分" if v is not None else "—"
-        return fmt(avg), fmt(wd), fmt(hr)
 
     # ランキング
-    @app.callback(Output("fig-ranking","figure"), Input("dd-range","value"))
-    def _ranking(range_key):
-        with open_conn(db_path) as con:
-            rows = get_ranking(con, _range_to_days(range_key), top_n=20)
-            if not rows and (range_key != "all"):  # フォールバック（親切）
-                rows = get_ranking(con, None, top_n=20)
+    @app.callback(Output("fig-ranking","figure"), Input("agg-store","data"), State("dd-range","value"),
+                  prevent_initial_call=True)
+    def _ranking(bundle, range_key):
+        rows = (bundle or {}).get("ranking")
+        if not rows and (range_key != "all"):  # フォールバック（親切）
+            rows = _cached_ranking(_db_version(), None)
         if not rows: return px.bar(title="データなし")
         fig = px.bar(rows, x="pavilion_name", y="avg_wait", hover_data=["n"],
                      labels={"avg_wait":"平均待ち分","pavilion_name":"パビリオン"},
                      title="平均待ち時間ランキング")
-        fig.update_layout(margin=dict(l=10,r=10,t=40,b=10), xaxis_tickangle=-30)
+        fig.update_layout(margin=dict(l=10,r=10,t=40,b=10), xaxis_tickangle=-30, uirevision="ranking")
         return fig
 
     # 最新テーブル
     @app.callback(Output("latest-wait-table","data"), Input("dd-range","value"))
     def _latest_table(range_key):
-        with open_conn(db_path) as con:
-            return get_latest_rows(con, _range_to_days(range_key), limit=20)
+        return _cached_latest_rows(_db_version(), _range_to_days(range_key))
 
     # 時系列
     @app.callback(Output("fig-timeseries","figure"),
                   Input("dd-range","value"), Input("dd-pavilion","value"))
     def _timeseries(range_key, names):
-        with open_conn(db_path) as con:
-            rows = get_time_series(con, names or [], _range_to_days(range_key))
-        if not rows:
+        ts, pav, val = _cached_time_series(_db_version(), tuple(names or ()), _range_to_days(range_key))
+        if len(ts) == 0:
             return go.Figure(layout_title_text="データなし")
-        df = pd.DataFrame(rows)
-        df["ts_hour"] = pd.to_datetime(df["ts_hour"])
-        fig = px.line(df, x="ts_hour", y="avg_wait", color="pavilion_name",
-                      labels={"ts_hour":"時刻","avg_wait":"待ち分","pavilion_name":"パビリオン"},
-                      title="待ち時間の時間推移（1時間平均）")
-        fig.update_layout(margin=dict(l=10,r=10,t=40,b=10))
+        # px.line（SVG）ではなく WebGL の Scattergl をパビリオンごとに直接組み立てる
+        # 配列はパビリオン順に連続しているので、名前が変わる位置で分割する
+        fig = go.Figure()
+        cuts = np.flatnonzero(pav[1:] != pav[:-1]) + 1
+        for x, name, y in zip(np.split(ts, cuts), np.split(pav, cuts), np.split(val, cuts)):
+            idx = lttb(x.astype(np.int64), y, TS_MAX_POINTS)
+            fig.add_trace(go.Scattergl(x=x[idx], y=y[idx], mode="lines", name=str(name[0])))
+        fig.update_layout(title="待ち時間の時間推移（1時間平均）",
+                          xaxis_title="時刻", yaxis_title="待ち分", legend_title_text="パビリオン",
+                          margin=dict(l=10,r=10,t=40,b=10),
+                          uirevision="ts")  # 更新時もズーム・パン状態を維持
         return fig
 
     # 曜日×時間帯ヒートマップ
-    @app.callback(Output("fig-weekday-heat","figure"), Input("dd-range","value"))
-    def _heat(range_key):
-        with open_conn(db_path) as con:
-            rows = get_weekday_hour(con, _range_to_days(range_key))
+    @app.callback(Output("fig-weekday-heat","figure"), Input("agg-store","data"), prevent_initial_call=True)
+    def _heat(bundle):
+        rows = (bundle or {}).get("weekday_hour")
         if not rows:
             return go.Figure(layout_title_text="データなし")
-        df = pd.DataFrame(rows)
-        df["weekday"] = pd.Categorical(df["weekday"], categories=WEEKDAY_ORDER, ordered=True)
-        hours_sorted = _sorted_hours(df["hour"].tolist())
-        df["hour"] = pd.Categorical(df["hour"], categories=hours_sorted, ordered=True)
-        pvt = df.pivot(index="weekday", columns="hour", values="avg_wait").reindex(WEEKDAY_ORDER)
-        fig = px.imshow(pvt, aspect="auto", origin="lower",
+        # DataFrame/pivot を介さず 7x24 の行列へ直接埋める（欠損は NaN のまま）
+        z = np.full((7, 24), np.nan, dtype=np.float32)
+        for r in rows:
+            z[r["weekday_idx"], r["hour_idx"]] = r["avg_wait"]
+        fig = px.imshow(z, x=HOUR_LABELS, y=WEEKDAY_ORDER, aspect="auto", origin="lower",
                         labels=dict(color="平均待ち分", x="時間帯", y="曜日"),
                         title="曜日 × 時間帯の平均待ち時間")
-        fig.update_layout(margin=dict(l=10,r=10,t=40,b=10))
+        fig.update_layout(margin=dict(l=10,r=10,t=40,b=10), uirevision="heat")
         return fig
 
     # 曜日別棒
-    @app.callback(Output("fig-weekday-bar","figure"), Input("dd-range","value"))
-    def _weekday_bar(range_key):
-        with open_conn(db_path) as con:
-            rows = get_weekday_bar(con, _range_to_days(range_key))
+    @app.callback(Output("fig-weekday-bar","figure"), Input("agg-store","data"), prevent_initial_call=True)
+    def _weekday_bar(bundle):
+        rows = (bundle or {}).get("weekday_bar")
         if not rows: return px.bar(title="データなし")
-        df = pd.DataFrame(rows)
-        df["weekday"] = pd.Categorical(df["weekday"], categories=WEEKDAY_ORDER, ordered=True)
-        df = df.sort_values("weekday")
-        fig = px.bar(df, x="weekday", y="avg_wait",
-                     labels={"weekday":"曜日","avg_wait":"平均待ち分"}, title="曜日別 平均待ち時間")
-        fig.update_layout(margin=dict(l=10,r=10,t=40,b=10))
+        rows = sorted(rows, key=lambda r: WEEKDAY_ORDER.index(r["weekday"]) if r["weekday"] in WEEKDAY_ORDER else 7)
+        fig = px.bar(x=[r["weekday"] for r in rows], y=[r["avg_wait"] for r in rows],
+                     labels={"x":"曜日","y":"平均待ち分"}, title="曜日別 平均待ち時間")
+        fig.update_layout(margin=dict(l=10,r=10,t=40,b=10), uirevision="weekday-bar")
         return fig
 
-    # 最終更新
-    @app.callback(Output("last-updated-text","children"), Input("dd-range","value"))
-    def _last_updated(_):
-        with open_conn(db_path) as con:
-            ts = get_last_updated(con)
-        if not ts: return "最終更新: —"
-        try:
-            dt = pd.to_datetime(ts)
-            return f"最終更新: {dt.strftime('%Y-%m-%d %H:%M')}"
-        except Exception:
-            return f"最終更新: {ts}"
-
-    # 地図（60秒キャッシュ）
-    @cache.memoize(timeout=60)
-    def _read_geojson(path: str):
-        with open(path, encoding="utf-8") as f:
-            return json.load(f)
-
-    @app.callback(Output("map-geojson","data"), Input("ivl-latest","n_intervals"))
-    def _update_map(_n):
-        return _read_geojson(map_json_path)
+    # 地図（ファイル更新時のみ再読込。ブラウザ側の mtime と同じなら送り直さない）
+    @app.callback(Output("map-geojson","data"), Output("map-mtime","data"),
+                  Input("ivl-latest","n_intervals"), State("map-mtime","data"))
+    def _update_map(_n, last_mtime):
+        mtime, data = _read_geojson(map_json_path)
+        if mtime == last_mtime:
+            raise PreventUpdate
+        return data, mtime
@@ -1,63 +1,186 @@
 # dash_app/data_access.py
 from __future__ import annotations
-import sqlite3, json
+import sqlite3, threading, atexit
+import orjson
+from functools import lru_cache
+from pathlib import Path
 from datetime import datetime, timezone, timedelta
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
+import numpy as np
 
 # ----- 基本設定 -----
 JST = timezone(timedelta(hours=9))
 
-def open_conn(db_path: str) -> sqlite3.Connection:
+# 読み取り中心のダッシュボード向け PRAGMA（WAL + 大きめのページキャッシュ / mmap）
+# journal_mode / synchronous は書き込み可能な接続でのみ設定する
+_PRAGMAS_RW = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+"""
+_PRAGMAS = """
+PRAGMA busy_timeout=5000;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=1073741824;
+PRAGMA cache_size=-65536;
+"""
+
+# waits_fact を直接読むクエリ用の部分インデックス（wait_min IS NOT NULL の行のみ）
+# 集計は waits_summary / waits_summary_pav を読むので、ここでは時系列（パビリオン指定）と最新テーブルの分だけ持つ
+_INDEX_DDL = """
+CREATE INDEX IF NOT EXISTS ix_waits_day_pav_name
+  ON waits_fact(day, pavilion_name) WHERE wait_min IS NOT NULL;
+CREATE INDEX IF NOT EXISTS ix_waits_ts_desc
+  ON waits_fact(timestamp DESC) WHERE wait_min IS NOT NULL;
+"""
+
+def open_conn(db_path: str, read_only: bool = False, immutable: bool = False) -> sqlite3.Connection:
     """
     Dash のコールバックは別スレッドで動くため、check_same_thread=False を必ず付与。
     row_factory=Row で dict 風アクセスを可能に。
+    read_only=True なら mode=ro の URI で開く。immutable=True はさらにロック・変更検知を省くが、
+    ファイルが書き換わらない前提（DB をイメージに焼き込んだ本番など）でのみ使うこと。
+    WAL の -wal 側も読まなくなるため、ETL やマウント経由で更新される DB には使わない。
     """
-    con = sqlite3.connect(db_path, check_same_thread=False)
+    if not read_only:
+        con = sqlite3.connect(db_path, check_same_thread=False)
+        con.row_factory = sqlite3.Row
+        con.executescript(_PRAGMAS_RW + _PRAGMAS)
+        return con
+
+    uri = Path(db_path).resolve().as_uri() + "?mode=ro&cache=shared" + ("&immutable=1" if immutable else "")
+    con = sqlite3.connect(uri, check_same_thread=False, uri=True)
     con.row_factory = sqlite3.Row
+    con.executescript(_PRAGMAS)
+    return con
+
+# ----- 接続プール（スレッドごとに RW 1本 + RO 1本を使い回す） -----
+_POOL: Dict[tuple, sqlite3.Connection] = {}
+_POOL_LOCK = threading.Lock()
+
+def _prune_dead_threads() -> None:
+    alive = {t.ident for t in threading.enumerate()}
+    for key in [k for k in _POOL if k[0] not in alive]:
+        _POOL.pop(key).close()
+
+def get_conn(db_path: str, read_only: bool = True, immutable: bool = False) -> sqlite3.Connection:
+    """
+    コールバックごとの open/close を避けるため、スレッド単位で接続をキャッシュして返す。
+    呼び出し側で close しないこと（終了時に close_all でまとめて閉じる）。
+    """
+    key = (threading.get_ident(), db_path, read_only, immutable)
+    con = _POOL.get(key)
+    if con is None:
+        con = open_conn(db_path, read_only=read_only, immutable=immutable)
+        with _POOL_LOCK:
+            _prune_dead_threads()
+            _POOL[key] = con
     return con
 
+@atexit.register
+def close_all() -> None:
+    with _POOL_LOCK:
+        while _POOL:
+            _POOL.popitem()[1].close()
+
+# 参照系 SQL が前提にする列（ETL / migrate_phase0 / init_db が作る。ダッシュボード側では作らない）
+_REQUIRED_COLUMNS = {
+    "waits_fact": ("pavilion_name",),
+    "waits_summary": ("hour_idx",),
+    "waits_summary_pav": ("pavilion_name",),
+}
+
+def check_schema(con: sqlite3.Connection) -> None:
+    """起動時に1回だけ呼ぶ。必要な表・列が無ければ DB には書き込まず、実行すべき処理を示して止める。"""
+    missing = []
+    for table, cols in _REQUIRED_COLUMNS.items():
+        have = {r[1] for r in con.execute(f"PRAGMA table_info({table})")}
+        missing += [table] if not have else [f"{table}.{c}" for c in cols if c not in have]
+    if missing:
+        raise RuntimeError(
+            f"DB に {', '.join(missing)} がありません。"
+            "先に ETL（python -m etl.etl）か scripts/migrate_phase0.py を実行してください"
+        )
+
+def ensure_indexes(con: sqlite3.Connection) -> None:
+    """起動時に1回だけ呼ぶ。既存なら何もしない（IF NOT EXISTS）。"""
+    list_indexes = "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='waits_fact'"
+    before = {r[0] for r in con.execute(list_indexes)}
+    con.executescript(_INDEX_DDL)
+    # 統計が無いとプランナーが新しいインデックスを選ばないことがあるので、今回作ったものだけ ANALYZE する
+    for name in {r[0] for r in con.execute(list_indexes)} - before:
+        con.execute(f"ANALYZE {name}")
+    con.commit()
+
 def get_latest_feature_collection(json_path: str) -> dict:
-    with open(json_path, encoding="utf-8") as f:
-        return json.load(f)
+    # orjson は bytes をそのままパースできるのでバイナリで読む
+    with open(json_path, "rb") as f:
+        return orjson.loads(f.read())
 
 def _cutoff_day(days: int) -> str:
     d = datetime.now(JST) - timedelta(days=days)
     return d.strftime("%Y-%m-%d")
 
+# ----- SQL 文の事前組み立て -----
+# 形（days 指定の有無・names 件数・mode）ごとに SQL 文字列を1つに固定し、呼び出し時はパラメータだけ束縛する。
+# sqlite3 の文キャッシュは SQL 文字列をキーにするため、同じ文字列を渡せばコンパイル済みの文が再利用される。
+def _by_days(template: str, alias: str = "w.") -> Dict[bool, str]:
+    """template 中の {where} を days 指定なし/ありの2通りに展開する。"""
+    where = f"WHERE {alias}wait_min IS NOT NULL"
+    return {
+        False: template.replace("{where}", where),
+        True: template.replace("{where}", where + f" AND {alias}day >= ?"),
+    }
+
+def _summary_by_days(template: str, conds: Tuple[str, ...] = ()) -> Dict[bool, str]:
+    """
+    ETL が作るロールアップ（waits_summary / waits_summary_pav）用の _by_days。
+    wait_min IS NULL の行はロールアップ時点で除外済みなので条件に含めない。
+    平均は行ごとの件数 n で重み付けした SUM(n * avg_wait) / SUM(n) で求める。
+    """
+    def where(cs) -> str:
+        return ("WHERE " + " AND ".join(cs)) if cs else ""
+    return {
+        False: template.replace("{where}", where(conds)),
+        True: template.replace("{where}", where(conds + ("day >= ?",))),
+    }
+
+_WAVG = "SUM(n * avg_wait) / SUM(n)"
+
+def _days_params(days: Optional[int]) -> List:
+    return [] if days is None else [_cutoff_day(days)]
+
 # ===== ドロップダウン =====
+_PAVILION_OPTIONS_SQL = """
+  SELECT DISTINCT pavilion_name
+  FROM waits_summary_pav
+  ORDER BY pavilion_name
+"""
+
 def get_pavilion_options(con: sqlite3.Connection) -> List[str]:
-    sql = """
-      SELECT DISTINCT COALESCE(d.name_canonical, w.pavilion_name_raw) AS pavilion_name
-      FROM waits_fact w
-      LEFT JOIN pavilion_dim d ON d.pavilion_id = w.pavilion_id
-      WHERE w.wait_min IS NOT NULL
-      ORDER BY pavilion_name
-    """
-    return [r["pavilion_name"] for r in con.execute(sql).fetchall()]
+    return [r["pavilion_name"] for r in con.execute(_PAVILION_OPTIONS_SQL).fetchall()]
 
 # ===== KPI =====
+_OVERALL_AVG_SQL = _summary_by_days(f"SELECT {_WAVG} AS v FROM waits_summary {{where}}")
+
 def get_overall_avg(con: sqlite3.Connection, days: Optional[int]) -> Optional[float]:
-    where, params = "WHERE wait_min IS NOT NULL", []
-    if days is not None:
-        where += " AND day >= ?"
-        params.append(_cutoff_day(days))
-    row = con.execute(f"SELECT AVG(wait_min) AS v FROM waits_fact {where}", params).fetchone()
+    row = con.execute(_OVERALL_AVG_SQL[days is not None], _days_params(days)).fetchone()
     return float(row["v"]) if row and row["v"] is not None else None
 
-def _dispersion(con: sqlite3.Connection, days: Optional[int], group_col: str) -> Optional[float]:
-    where, params = "WHERE wait_min IS NOT NULL", []
-    if days is not None:
-        where += " AND day >= ?"
-        params.append(_cutoff_day(days))
-    sql = f"""
+# 時間帯は文字列の hour ではなく整数の hour_idx で集計する（1対1なので結果は同じ）
+_DISPERSION_SQL = {
+    key: _summary_by_days(f"""
       WITH agg AS (
-        SELECT {group_col} AS g, AVG(wait_min) AS v
-        FROM waits_fact {where}
+        SELECT {group_col} AS g, {_WAVG} AS v
+        FROM waits_summary {{where}}
         GROUP BY {group_col}
       )
       SELECT MAX(v) - MIN(v) AS disp FROM agg
-    """
-    row = con.execute(sql, params).fetchone()
+    """)
+    for key, group_col in (("weekday", "weekday"), ("hour", "hour_idx"))
+}
+
+def _dispersion(con: sqlite3.Connection, days: Optional[int], group_col: str) -> Optional[float]:
+    row = con.execute(_DISPERSION_SQL[group_col][days is not None], _days_params(days)).fetchone()
     return float(row["disp"]) if row and row["disp"] is not None else None
 
 def get_weekday_dispersion(con: sqlite3.Connection, days: Optional[int]) -> Optional[float]:
@@ -67,103 +190,212 @@ def get_hour_dispersion(con: sqlite3.Connection, days: Optional[int]) -> Optiona
     return _dispersion(con, days, "hour")
 
 # ===== ランキング =====
+_RANKING_SQL = _summary_by_days(f"""
+  SELECT
+    pavilion_name,
+    {_WAVG} AS avg_wait,
+    SUM(n) AS n
+  FROM waits_summary_pav
+  {{where}}
+  GROUP BY pavilion_name
+  ORDER BY avg_wait DESC
+  LIMIT ?
+""")
+
 def get_ranking(con: sqlite3.Connection, days: Optional[int], top_n: int = 20) -> List[Dict]:
-    params, where = [], "WHERE w.wait_min IS NOT NULL"
-    if days is not None:
-        where += " AND w.day >= ?"
-        params.append(_cutoff_day(days))
-    sql = f"""
-      SELECT
-        COALESCE(d.name_canonical, w.pavilion_name_raw) AS pavilion_name,
-        AVG(w.wait_min) AS avg_wait,
-        COUNT(*) AS n
-      FROM waits_fact w
-      LEFT JOIN pavilion_dim d ON d.pavilion_id = w.pavilion_id
-      {where}
-      GROUP BY pavilion_name
-      ORDER BY avg_wait DESC
-      LIMIT ?
-    """
-    params.append(top_n)
-    return [dict(r) for r in con.execute(sql, params).fetchall()]
+    params = _days_params(days) + [top_n]
+    return [dict(r) for r in con.execute(_RANKING_SQL[days is not None], params).fetchall()]
 
 # ===== 最新テーブル =====
+# timestamp は fetch_data が JST の isoformat で書くため、文字列比較 timestamp >= 'YYYY-MM-DD' は day >= 'YYYY-MM-DD' と同値。
+# day ではなく timestamp で絞ることで ix_waits_ts_desc を降順に辿って LIMIT 件で打ち切れる（ソート不要）。
+_LATEST_ROWS_SQL = {
+    has_cutoff: f"""
+  SELECT
+    w.pavilion_name,
+    w.wait_min AS wait_time_minutes,
+    w.timestamp
+  FROM waits_fact w
+  WHERE w.wait_min IS NOT NULL{" AND w.timestamp >= ?" if has_cutoff else ""}
+  ORDER BY w.timestamp DESC
+  LIMIT ?
+"""
+    for has_cutoff in (False, True)
+}
+
 def get_latest_rows(con: sqlite3.Connection, days: Optional[int], limit: int = 20) -> List[Dict]:
-    params, where = [], "WHERE w.wait_min IS NOT NULL"
-    if days is not None:
-        where += " AND w.day >= ?"
-        params.append(_cutoff_day(days))
-    sql = f"""
-      SELECT
-        COALESCE(d.name_canonical, w.pavilion_name_raw) AS pavilion_name,
-        w.wait_min AS wait_time_minutes,
-        w.timestamp
-      FROM waits_fact w
-      LEFT JOIN pavilion_dim d ON d.pavilion_id = w.pavilion_id
-      {where}
-      ORDER BY w.timestamp DESC
-      LIMIT ?
-    """
-    params.append(limit)
-    return [dict(r) for r in con.execute(sql, params).fetchall()]
+    # 先に期間の下限（JST 0時の timestamp 文字列）を決め、その範囲の先頭 limit 件だけを読む
+    params = ([] if days is None else [_cutoff_day(days)]) + [limit]
+    return [dict(r) for r in con.execute(_LATEST_ROWS_SQL[days is not None], params).fetchall()]
 
 # ===== 時系列（1時間平均） =====
-def get_time_series(con: sqlite3.Connection, names: List[str] | None, days: Optional[int]) -> List[Dict]:
-    params, where = [], "WHERE w.wait_min IS NOT NULL"
-    if days is not None:
+@lru_cache(maxsize=64)
+def _time_series_sql(has_days: bool, n_names: int) -> str:
+    """IN 句のプレースホルダ数が変わるため、(days 有無, names 件数) ごとに組み立ててキャッシュする。"""
+    where = "WHERE w.wait_min IS NOT NULL"
+    if has_days:
         where += " AND w.day >= ?"
-        params.append(_cutoff_day(days))
-    if names:
-        ph = ",".join("?" * len(names))
-        where += f" AND COALESCE(d.name_canonical, w.pavilion_name_raw) IN ({ph})"
-        params.extend(names)
-    sql = f"""
+    if n_names:
+        ph = ",".join("?" * n_names)
+        where += f" AND w.pavilion_name IN ({ph})"
+    return f"""
       SELECT
         substr(COALESCE(w.data_time_jst, w.timestamp), 1, 13) || ':00' AS ts_hour,
-        COALESCE(d.name_canonical, w.pavilion_name_raw) AS pavilion_name,
+        w.pavilion_name,
         AVG(w.wait_min) AS avg_wait
       FROM waits_fact w
-      LEFT JOIN pavilion_dim d ON d.pavilion_id = w.pavilion_id
       {where}
       GROUP BY ts_hour, pavilion_name
-      ORDER BY ts_hour, pavilion_name
+      ORDER BY pavilion_name, ts_hour
     """
-    return [dict(r) for r in con.execute(sql, params).fetchall()]
+
+def get_time_series(
+    con: sqlite3.Connection, names: List[str] | None, days: Optional[int]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    戻り値: (ts_hour[datetime64[h]], pavilion_name[str], avg_wait[float32]) の列配列。
+    パビリオン→時刻の順に並ぶので、同じパビリオンの系列は連続している。
+    行ごとの dict / DataFrame を作らないよう、タプル行のまま列へ転置する。
+    """
+    names = names or []
+    sql = _time_series_sql(days is not None, len(names))
+    cur = con.cursor()
+    cur.row_factory = None  # Row ではなく素のタプルで受け取る
+    rows = cur.execute(sql, _days_params(days) + list(names)).fetchall()
+    ts, name, v = zip(*rows) if rows else ((), (), ())
+    return (np.array(ts, dtype="datetime64[h]"),
+            np.array(name, dtype=str),
+            np.array(v, dtype=np.float32))
 
 # ===== 曜日×時間帯ヒートマップ =====
+# 曜日名 → 0(月)〜6(日)。ヒートマップ行列の添字として使う
+_WEEKDAY_IDX_SQL = "CASE weekday " + " ".join(
+    f"WHEN '{w}' THEN {i}"
+    for i, w in enumerate(["月曜日","火曜日","水曜日","木曜日","金曜日","土曜日","日曜日"])
+) + " END"
+
+_WEEKDAY_HOUR_SQL = _summary_by_days(f"""
+  SELECT {_WEEKDAY_IDX_SQL} AS weekday_idx,
+         hour_idx,
+         {_WAVG} AS avg_wait
+  FROM waits_summary
+  {{where}}
+  GROUP BY weekday, hour_idx
+  HAVING weekday_idx IS NOT NULL
+  ORDER BY weekday_idx, hour_idx
+""", conds=("hour_idx IS NOT NULL",))
+
 def get_weekday_hour(con: sqlite3.Connection, days: Optional[int]) -> List[Dict]:
-    params, where = [], "WHERE wait_min IS NOT NULL"
-    if days is not None:
-        where += " AND day >= ?"
-        params.append(_cutoff_day(days))
-    sql = f"""
-      SELECT weekday, hour, AVG(wait_min) AS avg_wait
-      FROM waits_fact
-      {where}
-      GROUP BY weekday, hour
-    """
-    return [dict(r) for r in con.execute(sql, params).fetchall()]
+    """戻り値: [{weekday_idx(0-6), hour_idx(0-23), avg_wait}]（添字順）"""
+    return [dict(r) for r in con.execute(_WEEKDAY_HOUR_SQL[days is not None], _days_params(days)).fetchall()]
 
 # ===== 曜日別棒 =====
+_WEEKDAY_BAR_SQL = _summary_by_days(f"""
+  SELECT weekday, {_WAVG} AS avg_wait
+  FROM waits_summary
+  {{where}}
+  GROUP BY weekday
+""")
+
 def get_weekday_bar(con: sqlite3.Connection, days: Optional[int]) -> List[Dict]:
-    params, where = [], "WHERE wait_min IS NOT NULL"
-    if days is not None:
-        where += " AND day >= ?"
-        params.append(_cutoff_day(days))
-    sql = f"""
-      SELECT weekday, AVG(wait_min) AS avg_wait
-      FROM waits_fact
-      {where}
-      GROUP BY weekday
+    return [dict(r) for r in con.execute(_WEEKDAY_BAR_SQL[days is not None], _days_params(days)).fetchall()]
+
+# ===== dd-range 連動の集計をまとめて取得 =====
+_RANGE_BUNDLE_SQL = _summary_by_days(f"""
+  WITH filtered AS (
+    SELECT weekday, hour_idx, avg_wait, n
+    FROM waits_summary
+    {{where}}
+  ), filtered_pav AS (
+    SELECT pavilion_name, avg_wait, n
+    FROM waits_summary_pav
+    {{where}}
+  )
+  SELECT 'overall' AS kind, NULL AS k1, NULL AS k2, {_WAVG} AS v, SUM(n) AS n
+  FROM filtered
+  UNION ALL
+  SELECT 'pavilion', pavilion_name, NULL, {_WAVG}, SUM(n)
+  FROM filtered_pav GROUP BY pavilion_name
+  UNION ALL
+  SELECT 'weekday', weekday, NULL, {_WAVG}, SUM(n)
+  FROM filtered GROUP BY weekday
+  UNION ALL
+  SELECT 'hour', hour_idx, NULL, {_WAVG}, SUM(n)
+  FROM filtered GROUP BY hour_idx
+  UNION ALL
+  SELECT 'weekday_hour', {_WEEKDAY_IDX_SQL}, hour_idx, {_WAVG}, SUM(n)
+  FROM filtered WHERE hour_idx IS NOT NULL GROUP BY weekday, hour_idx
+""")
+
+def get_range_bundle(con: sqlite3.Connection, days: Optional[int], top_n: int = 20) -> Dict:
+    """
+    KPI / ランキング / 曜日×時間帯 / 曜日別 を1本の SQL でまとめて集計する（ETL が作るロールアップを読む）。
+    期間フィルタ済みの filtered / filtered_pav CTE を UNION ALL の各集計で共有し、kind 列で結果を振り分ける。
+    戻り値はそのまま dcc.Store に載せられる JSON 互換の dict。
     """
-    return [dict(r) for r in con.execute(sql, params).fetchall()]
+    overall = None
+    ranking: List[Dict] = []
+    by_weekday: Dict[Optional[str], float] = {}
+    by_hour: List[float] = []
+    heat: List[Dict] = []
+    # 期間条件は filtered / filtered_pav の2か所にあるので同じ値を2回渡す
+    rows = con.execute(_RANGE_BUNDLE_SQL[days is not None], _days_params(days) * 2).fetchall()
+    for kind, k1, k2, v, n in rows:
+        if kind == "overall":
+            overall = v
+        elif kind == "pavilion":
+            ranking.append({"pavilion_name": k1, "avg_wait": v, "n": n})
+        elif kind == "weekday":
+            by_weekday[k1] = v
+        elif kind == "hour":
+            by_hour.append(v)
+        elif k1 is not None:  # weekday_hour（曜日名が想定外の行は除外）
+            heat.append({"weekday_idx": k1, "hour_idx": k2, "avg_wait": v})
+
+    ranking.sort(key=lambda r: r["avg_wait"], reverse=True)
+    disp = lambda vs: float(max(vs) - min(vs)) if vs else None
+    return {
+        "overall_avg": float(overall) if overall is not None else None,
+        "weekday_disp": disp(list(by_weekday.values())),
+        "hour_disp": disp(by_hour),
+        "ranking": ranking[:top_n],
+        "weekday_hour": heat,
+        "weekday_bar": [{"weekday": k, "avg_wait": v} for k, v in by_weekday.items() if k is not None],
+    }
 
 # ===== 最終更新 =====
+_LAST_UPDATED_SQL = "SELECT MAX(timestamp) AS ts FROM waits_fact"
+
 def get_last_updated(con: sqlite3.Connection) -> Optional[str]:
-    row = con.execute("SELECT MAX(timestamp) AS ts FROM waits_fact").fetchone()
+    row = con.execute(_LAST_UPDATED_SQL).fetchone()
     return row["ts"] if row and row["ts"] else None
 
 # ===== 地図レイヤー用 集計 =====
+# mode ごとの絞り込み条件（プレースホルダの順にパラメータを渡す）
+_GEO_FILTERS = {
+    "date":      ["w.day = ?"],
+    "date_hour": ["w.day = ?", "w.hour = ?"],
+    "weekday":   ["w.weekday = ?"],
+    "hour":      ["w.hour = ?"],
+}
+_GEO_SQL = {
+    mode: f"""
+      SELECT
+        w.pavilion_id,
+        w.pavilion_name,
+        g.lon,
+        g.lat,
+        AVG(w.wait_min) AS avg_wait,
+        MAX(w.timestamp) AS last_ts
+      FROM waits_fact w
+      JOIN pavilion_geometry g ON g.pavilion_id = w.pavilion_id
+      WHERE {" AND ".join(["w.wait_min IS NOT NULL"] + conds)}
+        AND g.lon IS NOT NULL AND g.lat IS NOT NULL
+      GROUP BY w.pavilion_id
+    """
+    for mode, conds in _GEO_FILTERS.items()
+}
+
 def get_geo_rows(
     con: sqlite3.Connection,
     mode: str,
@@ -181,61 +413,15 @@ def get_geo_rows(
       - "hour"       : 時間帯別 hour="HH:00"
       - "latest"     : 使わない（MAP_JSONで別処理）
     """
-    where = ["w.wait_min IS NOT NULL"]
-    params: List[str] = []
-
-    if mode == "date":
-        if not day:  # パラメータ不足なら該当なし
-            return []
-        where.append("w.day = ?"); params.append(day)
-    elif mode == "date_hour":
-        if not (day and hour):
-            return []
-        where.append("w.day = ?");  params.append(day)
-        where.append("w.hour = ?"); params.append(hour)
-    elif mode == "weekday":
-        if not weekday:
-            return []
-        where.append("w.weekday = ?"); params.append(weekday)
-    elif mode == "hour":
-        if not hour:
-            return []
-        where.append("w.hour = ?"); params.append(hour)
-    else:
-        # 未知のモードは空返し
+    params = {
+        "date":      [day],
+        "date_hour": [day, hour],
+        "weekday":   [weekday],
+        "hour":      [hour],
+    }.get(mode)
+    # 未知のモード・パラメータ不足なら該当なし
+    if params is None or not all(params):
         return []
 
-    where_sql = "WHERE " + " AND ".join(where)
-
-    sql = f"""
-      SELECT
-        w.pavilion_id,
-        COALESCE(d.name_canonical, w.pavilion_name_raw) AS pavilion_name,
-        g.geojson AS gj,
-        AVG(w.wait_min) AS avg_wait,
-        MAX(w.timestamp) AS last_ts
-      FROM waits_fact w
-      LEFT JOIN pavilion_dim d      ON d.pavilion_id = w.pavilion_id
-      LEFT JOIN pavilion_geometry g ON g.pavilion_id = w.pavilion_id
-      {where_sql}
-      GROUP BY w.pavilion_id
-      HAVING gj IS NOT NULL
-    """
-
-    out: List[Dict] = []
-    for r in con.execute(sql, params).fetchall():
-        try:
-            gj = json.loads(r["gj"])
-            lon, lat = gj["geometry"]["coordinates"]  # [lon, lat]
-            out.append(dict(
-                pavilion_id   = r["pavilion_id"],
-                pavilion_name = r["pavilion_name"],
-                lon           = float(lon),
-                lat           = float(lat),
-                avg_wait      = float(r["avg_wait"]) if r["avg_wait"] is not None else None,
-                last_ts       = r["last_ts"],
-            ))
-        except Exception:
-            # 位置が壊れている等はスキップ
-            continue
-    return out
+    # 座標は pavilion_geometry.lon / lat 列から直接読む（行ごとの json.loads は不要）
+    return [dict(r) for r in con.execute(_GEO_SQL[mode], params).fetchall()]
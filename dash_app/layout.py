@@ -50,8 +50,8 @@ def create_layout():
             # グラフ群（ランキング / 曜日×時間帯ヒートマップ）
             dbc.Row(
                 [
-                    dbc.Col(dcc.Graph(id="fig-ranking"), md=6),
-                    dbc.Col(dcc.Graph(id="fig-weekday-heat"), md=6),
+                    dbc.Col(dcc.Loading(dcc.Graph(id="fig-ranking")), md=6),
+                    dbc.Col(dcc.Loading(dcc.Graph(id="fig-weekday-heat")), md=6),
                 ],
                 className="mb-4",
             ),
@@ -59,8 +59,8 @@ def create_layout():
             # グラフ群（時系列 / 曜日別棒）
             dbc.Row(
                 [
-                    dbc.Col(dcc.Graph(id="fig-timeseries"), md=6),
-                    dbc.Col(dcc.Graph(id="fig-weekday-bar"), md=6),
+                    dbc.Col(dcc.Loading(dcc.Graph(id="fig-timeseries")), md=6),
+                    dbc.Col(dcc.Loading(dcc.Graph(id="fig-weekday-bar")), md=6),
                 ],
                 className="mb-4",
             ),
@@ -92,6 +92,11 @@ def create_layout():
                 ],
             ),
             dcc.Interval(id="ivl-latest", interval=60_000, n_intervals=0),
+            dcc.Store(id="map-mtime"),  # 送信済み GeoJSON の mtime（変化が無ければ再送しない）
+
+            # dd-range 連動の集計結果（KPI / ランキング / ヒートマップ / 曜日別 / 最終更新で共有）
+            dcc.Store(id="agg-store"),
+            dcc.Store(id="agg-hash"),  # agg-store の内容ハッシュ（同じなら再送しない）
 
             html.Div(id="last-updated-text", style={"textAlign": "right", "marginTop": "10px"}),
         ],
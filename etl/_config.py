@@ -0,0 +1,17 @@
+# etl/_config.py
+"""etl/config/config.yaml の読み込み（プロセス内で1回だけパースし、etl と scripts で共有する）"""
+import functools
+from pathlib import Path
+
+import yaml
+
+CONFIG_PATH = Path(__file__).parent / "config/config.yaml"
+
+# libyaml 付きの PyYAML なら C 実装のローダーを使う（無ければ純 Python の SafeLoader）
+_Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+@functools.lru_cache(maxsize=1)
+def get_config() -> dict:
+    """設定辞書を返す。呼び出し側で書き換えないこと（全 import 元で同じ dict を共有する）"""
+    with open(CONFIG_PATH, "rb") as f:
+        return yaml.load(f, Loader=_Loader)
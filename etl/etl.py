@@ -1,13 +1,16 @@
 import pandas as pd
+import numpy as np
 import sqlite3
 import re
 import os
 import logging
 import unicodedata
+from contextlib import closing
 from datetime import datetime
-import yaml
 from pathlib import Path
 from typing import Optional
+from etl._config import get_config
+from etl.schema import ensure_pavilion_name_column, ensure_waits_summary, refresh_waits_summary
 from scripts.prepare_pavilion_master import main as prepare_pavilion_master
 
 # ----------------------------------
@@ -23,9 +26,7 @@ logger = logging.getLogger(__name__)
 # ----------------------------------
 # 設定読み込み
 # ----------------------------------
-config_path = Path(__file__).parent / "config/config.yaml"
-with open(config_path, 'r', encoding='utf-8') as yml:
-    config = yaml.safe_load(yml)
+config = get_config()
 
 # プロジェクトルート
 ROOT_DIR = Path(__file__).resolve().parents[1]
@@ -41,18 +42,21 @@ MASTER_CSV_PATH = ROOT_DIR / config.get("MASTER_CSV_PATH", "data/master/unused.c
 # ----------------------------------
 # 正規表現パターン
 # ----------------------------------
-WAIT_PATTERNS = [
-    (re.compile(r"^\s*(\d+)時間(\d+)分以下\s*$"), lambda h, m: int(h)*60 + int(m)),
-    (re.compile(r"^\s*(\d+)時間(\d+)分\s*$"),     lambda h, m: int(h)*60 + int(m)),
-    (re.compile(r"^\s*(\d+)分以下\s*$"),          lambda m: int(m)),
-    (re.compile(r"^\s*(\d+)分\s*$"),              lambda m: int(m)),
-]
-
-STALE_PATTERNS = [
-    (re.compile(r"^\s*(\d+)分前\s*$"),   lambda m: int(m)),
-    (re.compile(r"^\s*(\d+)時間前\s*$"), lambda h: int(h)*60),
-    (re.compile(r"^\s*60分以上前\s*$"),  lambda: 60),  # 運用方針：最低60分として扱う
-]
+# '1時間30分', '0時間10分以下', '15分', '15分以下' を1本で受ける（group1=時間（省略可）, group2=分）
+WAIT_RE = re.compile(r"^\s*(?:(\d+)時間)?(\d+)分(?:以下)?\s*$")
+
+# '12分前', '1時間前', '60分以上前' を1本で受ける（group1=分, group2=時間, group3=60分以上）
+# '60分以上前' は運用方針として最低値の60分として扱う
+STALE_RE = re.compile(r"^\s*(?:(\d+)分前|(\d+)時間前|(60)分以上前)\s*$")
+
+# 名寄せ用の空白除去
+WS_RE = re.compile(r"\s+")
+
+# dt.weekday（月曜=0）→ 日本語曜日。ロケールに依存せず整数コードから引く
+WEEKDAYS_JA = ["月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日", "日曜日"]
+
+# dt.hour → 時刻帯ラベル（24通りしかないので strftime せず引く）
+HOUR_RANGES = [f"{h:02d}:00" for h in range(24)]
 
 # ----------------------------------
 # ユーティリティ
@@ -62,11 +66,19 @@ def normalize_name(s: str) -> str:
     if not isinstance(s, str):
         return s
     s = unicodedata.normalize("NFKC", s)
-    return re.sub(r"\s+", "", s.strip())
+    return WS_RE.sub("", s.strip())
+
+# Raw CSV の列型。館名・待ち時間・更新表記は種類が百前後しかないので、読み込み時点で category にする
+# （行ごとの文字列オブジェクトを持たず、以降の factorize・重複除去も整数コードで済む）
+RAW_CSV_DTYPES = {
+    "pavilion_name": "category",
+    "wait_time_raw": "category",
+    "post_time_raw": "category",
+}
 
 def load_raw_data(csv_path: Path) -> pd.DataFrame:
     """RawのCSVデータを読み込む"""
-    df = pd.read_csv(csv_path)
+    df = pd.read_csv(csv_path, dtype=RAW_CSV_DTYPES)
     expected = {"timestamp", "pavilion_name", "wait_time_raw", "post_time_raw"}
     missing = expected - set(df.columns)
     if missing:
@@ -80,22 +92,58 @@ def parse_wait_time(raw: Optional[str]) -> Optional[int]:
     s = raw.strip()
     if s in ("情報なし", "—", "-", "不明", ""):
         return None
-    for pat, calc in WAIT_PATTERNS:
-        m = pat.match(s)
-        if m:
-            return calc(*m.groups())
+    m = WAIT_RE.match(s)
+    if m:
+        h, mins = m.groups()
+        return int(h or 0) * 60 + int(mins)
     return None
 
+def _map_unique(raw: pd.Series, parse_uniques) -> pd.Series:
+    """
+    列のユニーク値だけを parse_uniques（文字列 Series → float Series）で変換し、全行へ配る。
+    表記の種類は数十〜百程度しかないため、行ごとに正規表現を当てるより桁違いに速い。欠損は <NA>。
+    """
+    codes, uniques = pd.factorize(raw)
+    vals = parse_uniques(pd.Series(uniques, dtype="string")).to_numpy(dtype="float64")
+    # codes == -1（欠損）は末尾に足した NaN を指す
+    return pd.Series(np.append(vals, np.nan)[codes], index=raw.index).astype("Int32")
+
+def _wait_minutes(uniques: pd.Series) -> pd.Series:
+    # float64 への変換は全角数字も受け付ける（int() を使う parse_wait_time と同じ結果）
+    ext = uniques.str.extract(WAIT_RE.pattern).astype("float64")
+    return ext[0].fillna(0) * 60 + ext[1]
+
+def parse_wait_time_series(raw: pd.Series) -> pd.Series:
+    """parse_wait_time の列版（str.extract で一括抽出して分へ換算）"""
+    return _map_unique(raw, _wait_minutes)
+
 def parse_staleness_min(raw: Optional[str]) -> Optional[int]:
     """'12分前', '1時間前', '60分以上前' → 分"""
     if not isinstance(raw, str):
         return None
-    s = raw.strip()
-    for pat, calc in STALE_PATTERNS:
-        m = pat.match(s)
-        if m:
-            return calc(*m.groups()) if m.groups() else calc()
-    return None
+    m = STALE_RE.match(raw.strip())
+    if not m:
+        return None
+    mins, hours, cap = m.groups()
+    return int(mins) if mins is not None else int(hours) * 60 if hours is not None else int(cap)
+
+def _staleness_minutes(uniques: pd.Series) -> pd.Series:
+    ext = uniques.str.extract(STALE_RE.pattern).astype("float64")
+    return ext[0].fillna(ext[1] * 60).fillna(ext[2])
+
+def parse_staleness_min_series(raw: pd.Series) -> pd.Series:
+    """parse_staleness_min の列版（str.extract で一括抽出して分へ換算）"""
+    return _map_unique(raw, _staleness_minutes)
+
+def _strftime_unique(ts: pd.Series, fmt: str) -> pd.Series:
+    """
+    秒単位に切り捨てた時刻のユニーク値だけを strftime し、全行へ配る。
+    timestamp はマイクロ秒付きで行ごとに異なるが、秒まで落とせば1回の取得分がほぼ1つにまとまる。
+    """
+    codes, uniques = pd.factorize(ts.dt.floor("s"))
+    strs = pd.Series(uniques).dt.strftime(fmt).to_numpy(dtype=object)
+    # codes == -1（NaT）は末尾に足した NaN を指す
+    return pd.Series(np.append(strs, np.nan)[codes], index=ts.index)
 
 def enrich_time_features(df: pd.DataFrame) -> pd.DataFrame:
     """曜日・時間帯を追加（日本語曜日／時刻帯）"""
@@ -106,20 +154,18 @@ def enrich_time_features(df: pd.DataFrame) -> pd.DataFrame:
 
     df["timestamp_dt"] = ts
 
-    weekday_map = {
-        "Monday": "月曜日", "Tuesday": "火曜日", "Wednesday": "水曜日",
-        "Thursday": "木曜日", "Friday": "金曜日", "Saturday": "土曜日", "Sunday": "日曜日"
-    }
-    weekday_en = df["timestamp_dt"].dt.day_name()
-    df["weekday"] = weekday_en.map(weekday_map)
-    df["hour_range"] = df["timestamp_dt"].dt.strftime("%H:00")
+    # 曜日名を行ごとに作らず、曜日番号をそのまま category のコードに使う（NaT は -1 → 欠損）
+    weekday_codes = ts.dt.weekday.fillna(-1).to_numpy(dtype="int8")
+    df["weekday"] = pd.Categorical.from_codes(weekday_codes, categories=WEEKDAYS_JA)
+    hour_codes = ts.dt.hour.fillna(-1).to_numpy(dtype="int8")
+    df["hour_range"] = pd.Categorical.from_codes(hour_codes, categories=HOUR_RANGES)
 
     # data_time_jst：タイムゾーンがあればJSTへ、なければそのまま
     try:
         if pd.api.types.is_datetime64tz_dtype(df["timestamp_dt"].dtype):
-            df["data_time_jst"] = df["timestamp_dt"].dt.tz_convert("Asia/Tokyo").dt.strftime("%Y-%m-%dT%H:%M:%S%z")
+            df["data_time_jst"] = _strftime_unique(df["timestamp_dt"].dt.tz_convert("Asia/Tokyo"), "%Y-%m-%dT%H:%M:%S%z")
         else:
-            df["data_time_jst"] = df["timestamp_dt"].dt.strftime("%Y-%m-%dT%H:%M:%S")
+            df["data_time_jst"] = _strftime_unique(df["timestamp_dt"], "%Y-%m-%dT%H:%M:%S")
     except Exception as e:
         logger.warning(f"data_time_jst の生成で例外: {e}. 文字列化にフォールバックします。")
         df["data_time_jst"] = df["timestamp_dt"].astype(str)
@@ -152,9 +198,31 @@ def resolve_pavilion_id(name: Optional[str], alias_map: dict[str, str]) -> Optio
         return None
     return alias_map.get(normalize_name(name))
 
+def resolve_pavilion_id_series(names: pd.Series, alias_map: dict[str, str]) -> pd.Series:
+    """resolve_pavilion_id の列版。ユニークな名前だけを一括正規化（NFKC・空白除去）して alias_map を引く"""
+    if isinstance(names.dtype, pd.CategoricalDtype):
+        # category 列（main で変換済み）はカテゴリ自体がユニーク値なので、列を再ハッシュせずコードをそのまま使う
+        codes, uniques = names.cat.codes.to_numpy(), names.cat.categories
+    else:
+        codes, uniques = pd.factorize(names)
+    norm = pd.Series(uniques, dtype="string").str.normalize("NFKC").str.replace(WS_RE, "", regex=True)
+    ids = norm.map(alias_map).to_numpy(dtype=object)
+    # 未登録（NaN）と文字列以外（数値など）は None。codes == -1（欠損）は末尾の None を指す
+    ids[pd.isna(ids) | np.array([not isinstance(u, str) for u in uniques], dtype=bool)] = None
+    return pd.Series(np.append(ids, None)[codes], index=names.index, dtype=object)
+
 # ----------------------------------
 # DB I/O（waits_fact UPSERT / unresolved_names）
 # ----------------------------------
+# バルク書き込み向け PRAGMA（WAL + synchronous=NORMAL ならコミットごとの fsync が不要）
+ETL_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-65536;
+PRAGMA mmap_size=268435456;
+"""
+
 WAITS_FACT_DDL = """
 CREATE TABLE IF NOT EXISTS waits_fact (
   timestamp TEXT NOT NULL,
@@ -169,6 +237,7 @@ CREATE TABLE IF NOT EXISTS waits_fact (
   data_time_jst TEXT,
   day TEXT,     -- 追加
   hour TEXT,    -- 追加
+  pavilion_name TEXT,  -- 表示名（pavilion_dim.name_canonical、無ければ raw）を保持し、参照側の JOIN を不要にする
   PRIMARY KEY (timestamp, pavilion_id),
   FOREIGN KEY (pavilion_id) REFERENCES pavilion_dim(pavilion_id)
 );
@@ -189,6 +258,13 @@ def ensure_etl_tables(conn: sqlite3.Connection):
     conn.execute("PRAGMA foreign_keys = ON;")
     conn.execute(WAITS_FACT_DDL)
     conn.execute(UNRESOLVED_DDL)
+    ensure_pavilion_name_column(conn)
+    ensure_waits_summary(conn)
+    conn.commit()
+
+def _records(df: pd.DataFrame):
+    """executemany 用に行タプルを返す（sqlite3 がバインドできるよう欠損は None、数値は Python の int/float に揃える）"""
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
 
 def upsert_waits_fact(conn: sqlite3.Connection, df: pd.DataFrame):
     """waits_fact へ主キー(timestamp, pavilion_id)で重複なくINSERT"""
@@ -214,38 +290,53 @@ def upsert_waits_fact(conn: sqlite3.Connection, df: pd.DataFrame):
             df[c] = None
 
     insert_df = df[need_cols].rename(columns=cols_map)
-    insert_df.to_sql("_tmp_waits_fact", conn, if_exists="replace", index=False)
+    # 表示名は pavilion_dim.name_canonical、無ければ raw（パビリオン数は百件程度なので辞書で引く）
+    canonical = dict(conn.execute("SELECT pavilion_id, name_canonical FROM pavilion_dim WHERE name_canonical IS NOT NULL"))
+    insert_df["pavilion_name"] = insert_df["pavilion_id"].map(canonical).fillna(insert_df["pavilion_name_raw"])
+
+    # migrate_phase0 で day/hour を生成列として足した DB では、その列には書き込めない（値は SQLite 側で計算される）
+    generated = {r[1] for r in conn.execute("PRAGMA table_xinfo(waits_fact)") if r[6] in (2, 3)}
+    write_cols = [c for c in insert_df.columns if c not in generated]
 
-    conn.execute("""
+    # 一時表を介さず、1つのプリペアド文に全行をバインドして INSERT
+    # 本表への INSERT とロールアップ更新を1トランザクションにまとめる
+    insert_sql = f"""
         INSERT OR IGNORE INTO waits_fact
-        (timestamp, pavilion_id, pavilion_name_raw, wait_time_raw, post_time_raw,
-        wait_min, staleness_min, weekday, hour_range, data_time_jst, day, hour)   -- 追加
-        SELECT timestamp, pavilion_id, pavilion_name_raw, wait_time_raw, post_time_raw,
-            wait_min, staleness_min, weekday, hour_range, data_time_jst, day, hour -- 追加
-        FROM _tmp_waits_fact;
-    """)
-    conn.execute("DROP TABLE _tmp_waits_fact;")
+        ({", ".join(write_cols)})
+        VALUES ({", ".join("?" * len(write_cols))});
+    """
+    rows = list(_records(insert_df[write_cols]))
+    # 生 CSV は累積で、大半の行は既存（INSERT OR IGNORE で捨てられる）。日ごとに流して total_changes が動いた日、
+    # つまり実際に行が増えた日だけロールアップを作り直す（day が欠損の行は NaN のキーにまとまる）
+    changed_days = []
+    conn.execute("BEGIN IMMEDIATE;")
+    for day, pos in insert_df.groupby("day", dropna=False, sort=False).indices.items():
+        before = conn.total_changes
+        conn.executemany(insert_sql, map(rows.__getitem__, pos))
+        if conn.total_changes != before:
+            changed_days.append(day)
+    if changed_days:
+        refresh_waits_summary(conn, changed_days)
+    conn.commit()
 
 def insert_unresolved(conn: sqlite3.Connection, df_unresolved: pd.DataFrame):
     if df_unresolved.empty:
         return
 
-    # 必要列・重複・欠損を整理
+    # 必要列・欠損を整理（重複は主キー (timestamp, pavilion_name_raw) に対する INSERT OR IGNORE で SQLite 側が除外する）
     df_tmp = (df_unresolved.rename(columns={"pavilion_name": "pavilion_name_raw"})
               [["timestamp", "pavilion_name_raw", "wait_time_raw", "post_time_raw"]]
               .dropna(subset=["timestamp", "pavilion_name_raw"])
-              .drop_duplicates(subset=["timestamp", "pavilion_name_raw"])
              )
 
-    # pandas→一時表→INSERT OR IGNORE で本表へ
-    df_tmp.to_sql("_tmp_unresolved", conn, if_exists="replace", index=False)
-    conn.execute("""
+    # executemany で本表へ直接 INSERT OR IGNORE
+    conn.execute("BEGIN IMMEDIATE;")
+    conn.executemany("""
         INSERT OR IGNORE INTO unresolved_names
         (timestamp, pavilion_name_raw, wait_time_raw, post_time_raw)
-        SELECT timestamp, pavilion_name_raw, wait_time_raw, post_time_raw
-          FROM _tmp_unresolved;
-    """)
-    conn.execute("DROP TABLE _tmp_unresolved;")
+        VALUES (?, ?, ?, ?);
+    """, _records(df_tmp))
+    conn.commit()
 
 
 # ----------------------------------
@@ -264,32 +355,38 @@ def main():
     logger.info(f"Rawデータ件数: {len(raw_df)}")
 
     # 2) 待ち時間・鮮度の正規化
-    raw_df["wait_time_minutes"] = raw_df["wait_time_raw"].apply(parse_wait_time)
-    raw_df["staleness_min"] = raw_df["post_time_raw"].apply(parse_staleness_min)
+    raw_df["wait_time_minutes"] = parse_wait_time_series(raw_df["wait_time_raw"])
+    raw_df["staleness_min"] = parse_staleness_min_series(raw_df["post_time_raw"])
 
     # 3) 時間特徴量付与
+    # weekday / hour_range は category で返る（DB へは _records の astype(object) で文字列に戻して渡す）
     raw_df = enrich_time_features(raw_df)
 
     # 4) 名寄せ（pavilion_name → pavilion_id）
     alias_map = load_alias_map_from_db(DB_PATH)
-    raw_df["pavilion_id"] = raw_df["pavilion_name"].apply(lambda n: resolve_pavilion_id(n, alias_map))
+    raw_df["pavilion_id"] = resolve_pavilion_id_series(raw_df["pavilion_name"], alias_map)
     raw_df["day"]  = raw_df["data_time_jst"].str.slice(0, 10)
     raw_df["hour"] = raw_df["hour_range"]
 
-    unresolved = raw_df[raw_df["pavilion_id"].isna()][["timestamp", "pavilion_name", "wait_time_raw", "post_time_raw"]]
-    resolved = raw_df[raw_df["pavilion_id"].notna()].copy()
+    # マスクは1回だけ作り、全体の .copy() はしない（以降 resolved を書き換える処理は無い）
+    mask = raw_df["pavilion_id"].notna().to_numpy()
+    unresolved = raw_df.loc[~mask, ["timestamp", "pavilion_name", "wait_time_raw", "post_time_raw"]]
+    resolved = raw_df.loc[mask]
 
     # 5) バリデーション（重複除去）
     cleaned_df = validate_and_clean(resolved)
 
     # 6) DB 書き込み
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    with sqlite3.connect(str(DB_PATH)) as conn:
+    with closing(sqlite3.connect(str(DB_PATH))) as conn:
+        conn.executescript(ETL_PRAGMAS)
         ensure_etl_tables(conn)
         upsert_waits_fact(conn, cleaned_df)
         if not unresolved.empty:
             insert_unresolved(conn, unresolved)
             logger.warning(f"未解決パビリオン名: {len(unresolved)} 件（unresolved_names へ退避）")
+        # DB ファイル単体でリポジトリへコミットされるため、-wal の内容を本体へ書き戻して空にしておく
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
 
     logger.info("ETL処理が完了しました")
 
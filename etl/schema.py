@@ -0,0 +1,122 @@
+# etl/schema.py
+"""
+ETL・init_db・migrate_phase0 で共有する waits_fact 周りのスキーマ補助（DDL・列追加とバックフィル・集計ロールアップ）
+import しても設定読み込みやログ設定などの副作用が無いので、ETL 以外のスクリプトからも使える
+"""
+import json
+import logging
+import sqlite3
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# pavilion_dim の正規名が追加・変更されたら waits_fact.pavilion_name へ反映
+# （load_master の INSERT OR REPLACE は DELETE+INSERT になるため INSERT 側でも拾う）
+PAVILION_NAME_SYNC_DDL = """
+CREATE INDEX IF NOT EXISTS ix_waits_pav_name ON waits_fact(pavilion_id, pavilion_name);
+
+CREATE TRIGGER IF NOT EXISTS trg_pavilion_dim_name_ins AFTER INSERT ON pavilion_dim
+BEGIN
+  UPDATE waits_fact SET pavilion_name = NEW.name_canonical
+   WHERE pavilion_id = NEW.pavilion_id AND pavilion_name IS NOT NEW.name_canonical;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_pavilion_dim_name_upd AFTER UPDATE OF name_canonical ON pavilion_dim
+BEGIN
+  UPDATE waits_fact SET pavilion_name = NEW.name_canonical
+   WHERE pavilion_id = NEW.pavilion_id AND pavilion_name IS NOT NEW.name_canonical;
+END;
+"""
+
+def ensure_pavilion_name_column(conn: sqlite3.Connection):
+    """旧スキーマの waits_fact に pavilion_name 列を追加し、既存行を1回だけ埋める"""
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(waits_fact)")}
+    if "pavilion_name" not in cols:
+        conn.execute("ALTER TABLE waits_fact ADD COLUMN pavilion_name TEXT;")
+        conn.execute("""
+            UPDATE waits_fact
+               SET pavilion_name = COALESCE(
+                     (SELECT d.name_canonical FROM pavilion_dim d WHERE d.pavilion_id = waits_fact.pavilion_id),
+                     pavilion_name_raw);
+        """)
+        logger.info("waits_fact.pavilion_name を追加し、既存行をバックフィルしました")
+    conn.executescript(PAVILION_NAME_SYNC_DDL)
+
+# ダッシュボード集計用の日次ロールアップ。KPI/ランキング/ヒートマップ/曜日別はこの小さな2表だけを読む
+#   waits_summary     : 日×曜日×時間帯（パビリオン横断）… 曜日×時間帯・曜日別・時間帯別・全体平均
+#   waits_summary_pav : 日×パビリオン                   … ランキング・パビリオン一覧
+# 取得は概ね1時間に1回なので、日×時間帯×パビリオンで集計しても waits_fact とほぼ同じ行数になる。軸ごとに表を分ける。
+# 期間をまたぐ平均は SUM(n * avg_wait) / SUM(n) の加重平均で求める
+WAITS_SUMMARY_DDL = """
+CREATE TABLE IF NOT EXISTS waits_summary (
+  day TEXT,
+  weekday TEXT,
+  hour TEXT,
+  hour_idx INTEGER,  -- "HH:00" の HH（ヒートマップの列添字・並び順に使う）
+  avg_wait REAL NOT NULL,
+  n INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_waits_summary_day ON waits_summary(day);
+
+CREATE TABLE IF NOT EXISTS waits_summary_pav (
+  day TEXT,
+  pavilion_id TEXT NOT NULL,
+  pavilion_name TEXT,
+  avg_wait REAL NOT NULL,
+  n INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_waits_summary_pav_day ON waits_summary_pav(day);
+
+CREATE TRIGGER IF NOT EXISTS trg_pavilion_dim_name_ins_summary AFTER INSERT ON pavilion_dim
+BEGIN
+  UPDATE waits_summary_pav SET pavilion_name = NEW.name_canonical
+   WHERE pavilion_id = NEW.pavilion_id AND pavilion_name IS NOT NEW.name_canonical;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_pavilion_dim_name_upd_summary AFTER UPDATE OF name_canonical ON pavilion_dim
+BEGIN
+  UPDATE waits_summary_pav SET pavilion_name = NEW.name_canonical
+   WHERE pavilion_id = NEW.pavilion_id AND pavilion_name IS NOT NEW.name_canonical;
+END;
+"""
+
+# 出力先テーブル → 再集計 SQL（{scope} に対象日の条件が入る）
+WAITS_SUMMARY_ROLLUP_SQL = {
+    "waits_summary": """
+        INSERT INTO waits_summary (day, weekday, hour, hour_idx, avg_wait, n)
+        SELECT day, weekday, hour, CAST(substr(hour, 1, 2) AS INTEGER), AVG(wait_min), COUNT(*)
+          FROM waits_fact
+         WHERE wait_min IS NOT NULL {scope}
+         GROUP BY day, weekday, hour;
+    """,
+    "waits_summary_pav": """
+        INSERT INTO waits_summary_pav (day, pavilion_id, pavilion_name, avg_wait, n)
+        SELECT day, pavilion_id, pavilion_name, AVG(wait_min), COUNT(*)
+          FROM waits_fact
+         WHERE wait_min IS NOT NULL {scope}
+         GROUP BY day, pavilion_id, pavilion_name;
+    """,
+}
+
+# 指定日だけを作り直すための条件（:days は日付の JSON 配列。day が NULL の行は :has_null が真のときだけ対象）
+SUMMARY_SCOPE_DAYS = """
+   AND (day IN (SELECT value FROM json_each(:days))
+        OR (day IS NULL AND :has_null))"""
+
+def refresh_waits_summary(conn: sqlite3.Connection, days: Optional[list] = None):
+    """waits_summary / waits_summary_pav を再集計する。days 指定時はその日だけ作り直す（欠損値は day IS NULL）"""
+    scope, params = "", {}
+    if days is not None:
+        present = [d for d in days if isinstance(d, str)]
+        scope = SUMMARY_SCOPE_DAYS
+        params = {"days": json.dumps(present), "has_null": int(len(present) < len(days))}
+    for table, rollup_sql in WAITS_SUMMARY_ROLLUP_SQL.items():
+        conn.execute(f"DELETE FROM {table} WHERE 1 = 1 {scope}", params)
+        conn.execute(rollup_sql.format(scope=scope), params)
+
+def ensure_waits_summary(conn: sqlite3.Connection):
+    """waits_summary / waits_summary_pav を作成し、空なら既存の waits_fact 全体から1回だけ構築する"""
+    conn.executescript(WAITS_SUMMARY_DDL)
+    if any(conn.execute(f"SELECT 1 FROM {t} LIMIT 1").fetchone() is None for t in WAITS_SUMMARY_ROLLUP_SQL):
+        refresh_waits_summary(conn)
+        logger.info("waits_summary を waits_fact 全体から構築しました")
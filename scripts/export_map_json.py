@@ -15,12 +15,17 @@ DBから地図用GeoJSONを出力するエクスポータ（完全版）
 from __future__ import annotations
 
 import argparse
+import functools
 import json
 import sqlite3
+import sys
 from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta
 from typing import Iterable, List, Optional, Tuple, Dict, Any
 
+import numpy as np
+import orjson
+
 
 # ---------------------------
 # ユーティリティ
@@ -41,28 +46,51 @@ def coerce_list(v: Optional[str | Iterable[str]]) -> Optional[List[str]]:
         return parts or None
     return list(v)
 
-def p_percentile(values: List[float], p: float) -> float:
-    """単純なパーセンタイル（0-100）。values は非空を想定。"""
-    if not values:
-        return float("nan")
-    s = sorted(values)
-    k = (len(s) - 1) * (p / 100.0)
-    f = int(k)
-    c = min(f + 1, len(s) - 1)
-    if f == c:
-        return float(s[f])
-    d0 = s[f] * (c - k)
-    d1 = s[c] * (k - f)
-    return float(d0 + d1)
-
-def ensure_feature(geojson_str: str) -> Dict[str, Any]:
-    """DBに保存された geojson（Feature or Geometry）を Feature に正規化。"""
-    gj = json.loads(geojson_str)
+@functools.lru_cache(maxsize=4096)
+def _parse_geojson(geojson_str: str) -> Dict[str, Any]:
+    """geojson 文字列のパース結果（館ごとに同じ文字列が何度も来るのでキャッシュする）。"""
+    # パースは orjson（C 実装）。得られる dict / list / float は json.loads と同じ
+    gj = orjson.loads(geojson_str)
     if isinstance(gj, dict) and gj.get("type") == "Feature":
         return gj
     # Geometry の場合
     return {"type": "Feature", "properties": {}, "geometry": gj}
 
+def ensure_feature(geojson_str: str) -> Dict[str, Any]:
+    """DBに保存された geojson（Feature or Geometry）を Feature に正規化。"""
+    # キャッシュ上の dict を共有しないよう外側だけ複製する（呼び出し側は properties を差し替えるだけで geometry は触らない）
+    return dict(_parse_geojson(geojson_str))
+
+def write_feature_collection(out_path: str, features: Iterable[Dict[str, Any]], meta: Dict[str, Any],
+                             pretty: bool = False) -> int:
+    """
+    FeatureCollection を Feature 1件ずつファイルへ書き出し、件数を返す（features をリストにためない）。
+    既定はコンパクト出力。pretty=True なら従来の json.dump(indent=2) と同じ整形になる。
+    """
+    if pretty:
+        def dumps(o: Any, pad: str) -> str:
+            return json.dumps(o, ensure_ascii=False, indent=2).replace("\n", "\n" + pad)
+        head = '{\n  "type": "FeatureCollection",\n  "features": ['
+        item = lambda o: "\n    " + dumps(o, "    ")
+        close = "\n  ]"
+        tail = ',\n  "meta": ' + dumps(meta, "  ") + "\n}"
+    else:
+        def dumps(o: Any, pad: str) -> str:
+            return json.dumps(o, ensure_ascii=False, separators=(",", ":"))
+        head = '{"type":"FeatureCollection","features":['
+        item = lambda o: dumps(o, "")
+        close = "]"
+        tail = ',"meta":' + dumps(meta, "") + "}"
+
+    n = 0
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write(head)
+        for feat in features:
+            f.write(("," if n else "") + item(feat))
+            n += 1
+        # 空配列は従来どおり "[]"（改行を挟まない）
+        f.write((close if n else "]") + tail)
+    return n
 
 # ---------------------------
 # DBアクセス
@@ -106,143 +134,165 @@ def build_where_clause(f: Filters) -> Tuple[str, List[Any]]:
     clause = "WHERE " + " AND ".join(where) if where else "WHERE w.wait_min IS NOT NULL"
     return clause, params
 
-def fetch_latest(con: sqlite3.Connection, fresh_within: Optional[int]) -> List[sqlite3.Row]:
+def fetch_pavilion_meta(con: sqlite3.Connection) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """館名と geojson を pavilion_id 引きの辞書で返す（館数ぶんの小さな表なので一度に読む）。"""
+    names = {r[0]: r[1] for r in con.execute("SELECT pavilion_id, name_canonical FROM pavilion_dim")}
+    geoms = {r[0]: r[1] for r in con.execute("SELECT pavilion_id, geojson FROM pavilion_geometry")}
+    return names, geoms
+
+def has_latest_index(con: sqlite3.Connection) -> bool:
+    """fetch_latest のスキップスキャンが前提とする idx_waits_pav_ts（init_db.py / migrate_phase0.py が作る）があるか"""
+    return con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_waits_pav_ts'"
+    ).fetchone() is not None
+
+def fetch_latest(con: sqlite3.Connection, fresh_within: Optional[int]) -> Iterable[sqlite3.Row]:
     clause = "WHERE w.wait_min IS NOT NULL"
     params: List[Any] = []
     if fresh_within is not None:
         clause += " AND (w.staleness_min IS NULL OR w.staleness_min <= ?)"
         params.append(int(fresh_within))
 
+    # 館ごとの最新時刻は idx_waits_pav_ts 上のスキップスキャンで引く（表全体の GROUP BY を避ける）
+    #   pids  : MIN(pavilion_id) から「次に大きい pavilion_id」を再帰で辿り、館の一覧を館数ぶんの seek で得る
+    #   latest: 各館の MAX(timestamp) も (pavilion_id, timestamp DESC) の先頭1件を読むだけ
+    # 最新行の wait_min が NULL の館は従来どおり除外する（最新時刻を決めてから {clause} で絞る）
+    # 館名・geojson は fetch_pavilion_meta で別に引く
     sql = f"""
-    WITH latest AS (
-      SELECT pavilion_id, MAX(timestamp) AS ts
-      FROM waits_fact
-      GROUP BY pavilion_id
+    WITH RECURSIVE pids(pid) AS (
+      SELECT MIN(pavilion_id) FROM waits_fact
+      UNION ALL
+      SELECT (SELECT MIN(pavilion_id) FROM waits_fact WHERE pavilion_id > pid)
+      FROM pids WHERE pid IS NOT NULL
+    ),
+    latest AS (
+      SELECT pid AS pavilion_id,
+             (SELECT MAX(timestamp) FROM waits_fact WHERE pavilion_id = pid) AS ts
+      FROM pids
+      WHERE pid IS NOT NULL
     )
     SELECT w.pavilion_id,
-           d.name_canonical AS pavilion_name,
            w.wait_min,
            w.staleness_min,
-           w.data_time_jst,
-           g.geojson
-    FROM waits_fact w
-    JOIN latest l
+           w.data_time_jst
+    FROM latest l
+    JOIN waits_fact w
       ON w.pavilion_id=l.pavilion_id AND w.timestamp=l.ts
-    LEFT JOIN pavilion_dim d ON d.pavilion_id=w.pavilion_id
-    LEFT JOIN pavilion_geometry g ON g.pavilion_id=w.pavilion_id
     {clause}
     """
-    return con.execute(sql, params).fetchall()
+    return con.execute(sql, params)
+
+# stat → SQL の集約式（median / p90 は SQL に無いので group_percentile で求める）
+STAT_SQL = {
+    "avg": "AVG(w.wait_min)",
+    "max": "MAX(w.wait_min)",
+    "min": "MIN(w.wait_min)",
+}
+STAT_PERCENTILE = {"median": 50.0, "p90": 90.0}
 
-def fetch_for_aggregate(con: sqlite3.Connection, f: Filters) -> List[sqlite3.Row]:
+def group_percentile(counts: np.ndarray, vals: np.ndarray, p: float) -> np.ndarray:
+    """
+    グループごとに連続して並んだ vals（各グループの件数が counts）の線形補間パーセンタイルを一括で求める。
+    定義・補間式とも np.percentile（method="linear"）と同じ。
+    """
+    group = np.repeat(np.arange(len(counts)), counts)
+    sv = vals[np.lexsort((vals, group))]           # グループ内を昇順に
+    starts = np.cumsum(counts) - counts
+    k = (counts - 1) * (p / 100.0)
+    lo = np.floor(k).astype(np.int64)
+    hi = np.minimum(lo + 1, counts - 1)
+    a, b, t = sv[starts + lo], sv[starts + hi], k - lo
+    d = b - a
+    return np.where(t >= 0.5, b - d * (1 - t), a + d * t)
+
+def fetch_aggregate(con: sqlite3.Connection, f: Filters, stat: str) -> Iterable[Tuple[str, float, int]]:
+    """館ごとの (pavilion_id, 集計値, サンプル数) を返す。行ごとの値を Python オブジェクトにしない。"""
     clause, params = build_where_clause(f)
+    params = [*params, f.min_samples or 0]
+    # 館名・geojson は fetch_pavilion_meta で別に引くので JOIN しない（waits_fact のインデックスだけで完結する）
+    if stat in STAT_PERCENTILE:
+        # 値は館ごとに group_concat した1本の文字列で受け取り、NumPy で一括パースする
+        rows = con.execute(f"""
+        SELECT w.pavilion_id, COUNT(*), group_concat(w.wait_min)
+        FROM waits_fact w
+        {clause}
+        GROUP BY w.pavilion_id
+        HAVING COUNT(*) >= ?
+        """, params).fetchall()
+        if not rows:
+            return []
+        pids, counts, joined = zip(*rows)
+        counts = np.array(counts, dtype=np.int64)
+        vals = np.fromstring(",".join(joined), dtype=np.float64, sep=",")
+        return zip(pids, group_percentile(counts, vals, STAT_PERCENTILE[stat]).tolist(), counts.tolist())
+
     sql = f"""
     SELECT w.pavilion_id,
-           d.name_canonical AS pavilion_name,
-           w.wait_min,
-           g.geojson
+           {STAT_SQL.get(stat, STAT_SQL["avg"])} AS value,
+           COUNT(*) AS n
     FROM waits_fact w
-    LEFT JOIN pavilion_dim d ON d.pavilion_id=w.pavilion_id
-    LEFT JOIN pavilion_geometry g ON g.pavilion_id=w.pavilion_id
     {clause}
+    GROUP BY w.pavilion_id
+    HAVING COUNT(*) >= ?
     """
-    return con.execute(sql, params).fetchall()
+    return con.execute(sql, params)
 
 
 # ---------------------------
 # エクスポート本体
 # ---------------------------
-def export_latest(con: sqlite3.Connection, out_path: str, fresh_within: Optional[int]) -> int:
-    rows = fetch_latest(con, fresh_within)
-    feats: List[Dict[str, Any]] = []
-    for r in rows:
-        gj = ensure_feature(r["geojson"])
-        gj["properties"] = {
-            "pavilion_id": r["pavilion_id"],
-            "pavilion_name": r["pavilion_name"],
-            "wait_min": r["wait_min"],
-            "staleness_min": r["staleness_min"],
-            "data_time_jst": r["data_time_jst"],
-        }
-        feats.append(gj)
-
-    fc = {
-        "type": "FeatureCollection",
-        "features": feats,
-        "meta": {
-            "mode": "latest",
-            "fresh_within": fresh_within,
-            "generated_at": now_iso(),
-        }
+def export_latest(con: sqlite3.Connection, out_path: str, fresh_within: Optional[int], pretty: bool = False) -> int:
+    names, geoms = fetch_pavilion_meta(con)
+
+    def features():
+        for r in fetch_latest(con, fresh_within):
+            pid = r["pavilion_id"]
+            gj = ensure_feature(geoms.get(pid))
+            gj["properties"] = {
+                "pavilion_id": pid,
+                "pavilion_name": names.get(pid),
+                "wait_min": r["wait_min"],
+                "staleness_min": r["staleness_min"],
+                "data_time_jst": r["data_time_jst"],
+            }
+            yield gj
+
+    meta = {
+        "mode": "latest",
+        "fresh_within": fresh_within,
+        "generated_at": now_iso(),
     }
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(fc, f, ensure_ascii=False, indent=2)
-    return len(feats)
-
-def export_aggregate(con: sqlite3.Connection, out_path: str, stat: str, filters: Filters) -> int:
-    rows = fetch_for_aggregate(con, filters)
-
-    # pavilion_idごとに値を貯める
-    by_pid: Dict[str, Tuple[List[float], Tuple[str, str]]] = {}  # pid -> ([waits], (name, geojson))
-    for r in rows:
-        if r["wait_min"] is None:
-            continue
-        lst, meta = by_pid.setdefault(r["pavilion_id"], ([], (r["pavilion_name"], r["geojson"])))
-        lst.append(float(r["wait_min"]))
-        by_pid[r["pavilion_id"]] = (lst, meta)
-
-    feats: List[Dict[str, Any]] = []
-    for pid, (vals, (name, geojson_str)) in by_pid.items():
-        if len(vals) < (filters.min_samples or 0):
-            continue
-
-        if stat == "avg":
-            v = sum(vals) / len(vals)
-        elif stat == "max":
-            v = max(vals)
-        elif stat == "min":
-            v = min(vals)
-        elif stat == "median":
-            vals_sorted = sorted(vals)
-            n = len(vals_sorted)
-            mid = n // 2
-            v = (vals_sorted[mid] if n % 2 == 1 else (vals_sorted[mid-1] + vals_sorted[mid]) / 2.0)
-        elif stat == "p90":
-            v = p_percentile(vals, 90)
-        else:
-            v = sum(vals) / len(vals)
-
-        gj = ensure_feature(geojson_str)
-        gj["properties"] = {
-            "pavilion_id": pid,
-            "pavilion_name": name,
-            "value": round(v),         # 前段の色分けルールに合わせて四捨五入
-            "stat": stat,
-            "n": len(vals),
-        }
-        feats.append(gj)
-
-    fc = {
-        "type": "FeatureCollection",
-        "features": feats,
-        "meta": {
-            "mode": "aggregate",
-            "stat": stat,
-            "filters": {
-                "day": filters.day,
-                "date_from": filters.date_from,
-                "date_to": filters.date_to,
-                "weekday": filters.weekday,
-                "hour": filters.hour,
-                "min_samples": filters.min_samples,
-            },
-            "generated_at": now_iso(),
-        }
+    return write_feature_collection(out_path, features(), meta, pretty)
+
+def export_aggregate(con: sqlite3.Connection, out_path: str, stat: str, filters: Filters, pretty: bool = False) -> int:
+    names, geoms = fetch_pavilion_meta(con)
+
+    def features():
+        for pid, value, n in fetch_aggregate(con, filters, stat):
+            gj = ensure_feature(geoms.get(pid))
+            gj["properties"] = {
+                "pavilion_id": pid,
+                "pavilion_name": names.get(pid),
+                "value": round(value),         # 前段の色分けルールに合わせて四捨五入
+                "stat": stat,
+                "n": n,
+            }
+            yield gj
+
+    meta = {
+        "mode": "aggregate",
+        "stat": stat,
+        "filters": {
+            "day": filters.day,
+            "date_from": filters.date_from,
+            "date_to": filters.date_to,
+            "weekday": filters.weekday,
+            "hour": filters.hour,
+            "min_samples": filters.min_samples,
+        },
+        "generated_at": now_iso(),
     }
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(fc, f, ensure_ascii=False, indent=2)
-    return len(feats)
-
+    return write_feature_collection(out_path, features(), meta, pretty)
 
 # ---------------------------
 # CLI
@@ -252,6 +302,7 @@ def main():
     ap.add_argument("db_path", help="SQLite DB path (e.g., data/db/wait_times.db)")
     ap.add_argument("out_path", help="Output JSON path (e.g., data/out/map_latest.json)")
     ap.add_argument("--mode", choices=["latest", "aggregate"], default="latest")
+    ap.add_argument("--pretty", action="store_true", help="インデント付きで出力（既定はコンパクト）")
 
     # latest 用
     ap.add_argument("--fresh-within", type=int, default=None, help="最新モード: 鮮度がN分以内のものだけに制限")
@@ -281,10 +332,13 @@ def main():
     con.row_factory = sqlite3.Row
     try:
         if args.mode == "latest":
-            n = export_latest(con, args.out_path, filters.fresh_within)
+            if not has_latest_index(con):
+                print("[warn] idx_waits_pav_ts がありません。館ごとの最新行は全走査になります"
+                      "（scripts/migrate_phase0.py で作成できます）", file=sys.stderr)
+            n = export_latest(con, args.out_path, filters.fresh_within, args.pretty)
             print(f"[latest] features={n} → {args.out_path}")
         else:
-            n = export_aggregate(con, args.out_path, args.stat, filters)
+            n = export_aggregate(con, args.out_path, args.stat, filters, args.pretty)
             print(f"[aggregate:{args.stat}] features={n} → {args.out_path}")
     finally:
         con.close()
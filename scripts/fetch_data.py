@@ -1,6 +1,7 @@
 import requests
-import json
-import re
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 from datetime import datetime, timezone, timedelta
 import csv
 import os
@@ -27,18 +28,36 @@ with open(config_path, 'r') as yml:
 SHEET_ID = config['SHEET_ID']
 CSV_FILE = ROOT_DIR / config['CSV_FILE']  # ← ここをルート基準の絶対パスに変換
 
+# 接続を使い回すセッション（一時的な 429 / 5xx は指数バックオフで再試行）
+# Accept-Encoding: gzip, deflate は requests の既定ヘッダーで付く
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=1,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+))
+# (接続, 読み取り) タイムアウト秒。無応答で Actions のジョブが止まらないようにする
+REQUEST_TIMEOUT = (5, 30)
+
+# gviz の JSONP ラッパー: /*O_o*/\ngoogle.visualization.Query.setResponse({...});
+JSONP_PREFIX = b"setResponse("
+
+# 改行・タブを空白へ置き換える変換表（str.translate で1パスにまとめる）
+_CLEAN_TRANS = str.maketrans({"\n": " ", "\r": " ", "\t": " "})
+
 def clean_text(text: str) -> str:
-    return str(text).replace('\n', ' ').replace('\r', ' ').replace('\t', ' ').strip()
+    return str(text).translate(_CLEAN_TRANS).strip()
 
 def fetch_wait_times_from_sheet():
     try:
         url = f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/gviz/tq?tqx=out:json"
-        response = requests.get(url)
+        response = _SESSION.get(url, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
 
-        # JSONP から中身を取り出す
-        json_text = re.search(r"setResponse\((.*)\);", response.text, re.DOTALL).group(1)
-        data = json.loads(json_text)
+        # JSONP から中身を取り出す（ラッパーは固定なので正規表現を使わず位置で切り出す）
+        # str へデコードせず、バイト列のまま orjson に渡す（UTF-8 の検証はパース時に行われる）
+        body = response.content
+        data = orjson.loads(body[body.index(JSONP_PREFIX) + len(JSONP_PREFIX):body.rindex(b")")])
 
         rows = data["table"]["rows"]
         extracted_rows = []
@@ -1,5 +1,12 @@
 # scripts/init_db.py
 import sqlite3, os, sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+from etl.schema import ensure_pavilion_name_column, ensure_waits_summary
+
 DB_PATH = sys.argv[1] if len(sys.argv)>1 else "data/db/app.db"
 
 DDL = """
@@ -23,6 +30,8 @@ CREATE TABLE IF NOT EXISTS pavilion_alias (
 CREATE TABLE IF NOT EXISTS pavilion_geometry (
   pavilion_id TEXT PRIMARY KEY,
   geojson TEXT NOT NULL,
+  lon REAL,  -- Point の経度（地図集計で geojson をパースせずに使う）
+  lat REAL,  -- Point の緯度
   FOREIGN KEY (pavilion_id) REFERENCES pavilion_dim(pavilion_id)
 );
 
@@ -37,10 +46,24 @@ CREATE TABLE IF NOT EXISTS waits_fact (
   weekday TEXT,
   hour_range TEXT,
   data_time_jst TEXT,
+  day TEXT,   -- data_time_jst の日付部分（YYYY-MM-DD）
+  hour TEXT,  -- hour_range と同じ（HH:00）
+  pavilion_name TEXT,  -- 表示名（name_canonical、無ければ raw）。ETL が書き込む
   PRIMARY KEY (timestamp, pavilion_id),
   FOREIGN KEY (pavilion_id) REFERENCES pavilion_dim(pavilion_id)
 );
 
+-- export_map_json の aggregate（日付／曜日 × 時間帯で絞り込み）を index range scan にする
+-- wait_min IS NOT NULL の行だけの部分インデックスで、末尾の wait_min までで本表を引かずに済む
+CREATE INDEX IF NOT EXISTS idx_waits_day_hour_cover
+  ON waits_fact(day, hour, pavilion_id, wait_min) WHERE wait_min IS NOT NULL;
+-- 曜日×時間帯は timestamp / pavilion_name まで含め、地図レイヤーの集計（dash_app の _GEO_SQL）も本表を引かずに済ませる
+CREATE INDEX IF NOT EXISTS idx_waits_weekday_hour_cover
+  ON waits_fact(weekday, hour, pavilion_id, wait_min, timestamp, pavilion_name) WHERE wait_min IS NOT NULL;
+-- export_map_json の latest（館ごとの最新行）を館単位の index seek にする
+CREATE INDEX IF NOT EXISTS idx_waits_pav_ts
+  ON waits_fact(pavilion_id, timestamp DESC);
+
 CREATE TABLE IF NOT EXISTS unresolved_names (
   timestamp TEXT NOT NULL,
   pavilion_name_raw TEXT NOT NULL,
@@ -67,4 +90,7 @@ LEFT JOIN pavilion_geometry g ON w.pavilion_id = g.pavilion_id;
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 with sqlite3.connect(DB_PATH) as conn:
     conn.executescript(DDL)
+    # pavilion_name の同期トリガー・索引と、ダッシュボード集計用ロールアップ（ETL と同じ定義）
+    ensure_pavilion_name_column(conn)
+    ensure_waits_summary(conn)
 print(f"Initialized: {os.path.abspath(DB_PATH)}")
@@ -1,78 +1,97 @@
 # scripts/load_master_from_geojson.py
-import json, sqlite3, sys, hashlib, unicodedata, re, os
-from collections import OrderedDict
+import sqlite3, sys, os
+from pathlib import Path
+
+import orjson
+
+# python scripts/load_master_from_geojson.py で直接実行しても scripts パッケージを import できるようにする
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+from etl._config import get_config
+from scripts.pavilion_norm import DEFAULT_PAV_ID_HASH, normalize_name, pavilion_ids
+from scripts.sqlite_bulk import BULK_PRAGMAS, bulk_insert
 
 DB_PATH = sys.argv[1] if len(sys.argv)>1 else "data/db/app.db"
 GEOJSON_PATH = sys.argv[2] if len(sys.argv)>2 else "data/geo/pavilions_points.geojson"
 
-def normalize_name(s: str) -> str:
-    s = unicodedata.normalize("NFKC", s)
-    s = s.strip()
-    s = re.sub(r"\s+", "", s)        # 空白除去
-    return s
+def make_pavilion_ids(norm_names: list[str]) -> list[str]:
+    # 日本語でも安定する短いID: pav_ + ハッシュ先頭8桁（正規化済みの名前を全件まとめてハッシュ）
+    return pavilion_ids(norm_names, 8, get_config().get("PAV_ID_HASH", DEFAULT_PAV_ID_HASH))
+
+def point_lonlat(geom):
+    """Point なら (lon, lat)、それ以外・欠損は (None, None)"""
+    if not geom or geom.get("type") != "Point":
+        return None, None
+    lon, lat = geom["coordinates"][:2]
+    return float(lon), float(lat)
 
-def make_pavilion_id(name: str) -> str:
-    # 日本語でも安定する短いID: pav_ + sha1先頭8桁
-    base = normalize_name(name)
-    return "pav_" + hashlib.sha1(base.encode("utf-8")).hexdigest()[:8]
+def iter_dim_rows(by_name: dict, ids: list[str]):
+    """pavilion_dim の行 (pavilion_id, name_canonical, area, format, duration_minutes) を順に返す"""
+    for (name, (area, duration, _)), pavilion_id in zip(by_name.items(), ids):
+        yield (pavilion_id, name, area, None, duration)
+
+def iter_geom_rows(by_name: dict, ids: list[str]):
+    """pavilion_geometry の行 (pavilion_id, geojson, lon, lat) を順に返す（geojson 文字列は取り出されるたびに作る）"""
+    for (_, _, geom), pavilion_id in zip(by_name.values(), ids):
+        # Feature全文を保存（プロパティはDB側のJOINで付与する前提なので空）
+        # 外側は固定なので dict は組まず、geometry だけを orjson で dumps して f-string のテンプレートに埋め込む
+        # （UTF-8 のまま出るので ensure_ascii 相当の指定は不要）
+        geojson_str = f'{{"type":"Feature","properties":{{}},"geometry":{orjson.dumps(geom).decode()}}}'
+        lon, lat = point_lonlat(geom)
+        yield (pavilion_id, geojson_str, lon, lat)
 
 def main():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    with open(GEOJSON_PATH, "r", encoding="utf-8") as f:
-        fc = json.load(f)
+    # バイト列のまま orjson でパース（UTF-8 の検証はパース時に行われる）
+    with open(GEOJSON_PATH, "rb") as f:
+        fc = orjson.loads(f.read())
 
     # 名前重複（例: アイルランドが2回）を除去（最初に出たものを採用）
-    by_name = OrderedDict()
+    # Feature 全体ではなく、後で使う properties / geometry だけを残す
+    # 最初に出た順は通常の dict でも保たれる（OrderedDict 固有の機能は使っていない）
+    by_name = {}
     for feat in fc["features"]:
-        name = feat.get("properties", {}).get("pavilion_name")
+        props = feat.get("properties", {}) or {}
+        name = props.get("pavilion_name")
         if not name:
             continue
         if name not in by_name:
-            by_name[name] = feat
-
-    rows_dim = []
-    rows_alias = []
-    rows_geom = []
+            by_name[name] = (props.get("area"), props.get("duration_minutes"), feat.get("geometry"))
+    del fc  # 以降は by_name だけで足りるので、パース結果全体はここで手放す
 
-    for name, feat in by_name.items():
-        props = feat.get("properties", {}) or {}
-        area = props.get("area")
-        duration = props.get("duration_minutes")
-        pavilion_id = make_pavilion_id(name)
-
-        rows_dim.append((pavilion_id, name, area, None, duration if duration is not None else None))
-        # とりあえず正規名＝別名1本で登録（後でエイリアスを追加）
-        rows_alias.append((normalize_name(name), pavilion_id))
-
-        # geometry or feature全文を保存（ここではFeature全文を推奨）
-        geojson_str = json.dumps({
-            "type": "Feature",
-            "properties": {},   # プロパティはDB側のJOINで付与する前提
-            "geometry": feat.get("geometry")
-        }, ensure_ascii=False)
-        rows_geom.append((pavilion_id, geojson_str))
+    # 正規化は1館1回だけ行い、ID と alias キーの両方に使う
+    norms = [normalize_name(n) for n in by_name]
+    ids = make_pavilion_ids(norms)
 
     with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
+        conn.executescript(BULK_PRAGMAS)
+        # 旧スキーマなら lon/lat 列を追加
+        cols = {r[1] for r in conn.execute("PRAGMA table_info(pavilion_geometry)")}
+        for c in ("lon", "lat"):
+            if c not in cols:
+                conn.execute(f"ALTER TABLE pavilion_geometry ADD COLUMN {c} REAL")
+        conn.commit()
+        # 3表ぶんを1トランザクションで、複数行 VALUES の INSERT にまとめて投入
+        conn.execute("BEGIN IMMEDIATE;")
+        # 既存行と内容が同じものは書かない（REPLACE は DELETE+INSERT で索引も書き直し、ETL のトリガーも走るため）
+        # 館数ぶんの小さな表なので、ハッシュ列を持たずに現在値をそのまま読んで比べる
+        cur_dim = {r[0]: r for r in conn.execute(
+            "SELECT pavilion_id, name_canonical, area, format, duration_minutes FROM pavilion_dim")}
+        cur_alias = {r[0]: r for r in conn.execute("SELECT alias, pavilion_id FROM pavilion_alias")}
+        cur_geom = {r[0]: r for r in conn.execute("SELECT pavilion_id, geojson, lon, lat FROM pavilion_geometry")}
+        # 行はジェネレータで作り、既存と同じものを除きながら batch 行ずつ流す（3表ぶんの行リストを溜めない）
         # 重複を上書きしたくない場合は INSERT OR IGNORE に
-        cur.executemany(
-            """INSERT OR REPLACE INTO pavilion_dim
-               (pavilion_id, name_canonical, area, format, duration_minutes)
-               VALUES (?, ?, ?, ?, ?)""",
-            rows_dim,
-        )
-        cur.executemany(
-            """INSERT OR IGNORE INTO pavilion_alias
-               (alias, pavilion_id) VALUES (?, ?)""",
-            rows_alias,
-        )
-        cur.executemany(
-            """INSERT OR REPLACE INTO pavilion_geometry
-               (pavilion_id, geojson) VALUES (?, ?)""",
-            rows_geom,
-        )
+        n_dim = bulk_insert(conn,
+            "INSERT OR REPLACE INTO pavilion_dim (pavilion_id, name_canonical, area, format, duration_minutes)",
+            (r for r in iter_dim_rows(by_name, ids) if cur_dim.get(r[0]) != r))
+        # とりあえず正規名＝別名1本で登録（後でエイリアスを追加）
+        n_alias = bulk_insert(conn, "INSERT OR IGNORE INTO pavilion_alias (alias, pavilion_id)",
+            (r for r in zip(norms, ids) if r[0] not in cur_alias))
+        n_geom = bulk_insert(conn, "INSERT OR REPLACE INTO pavilion_geometry (pavilion_id, geojson, lon, lat)",
+            (r for r in iter_geom_rows(by_name, ids) if cur_geom.get(r[0]) != r))
         conn.commit()
-    print(f"Inserted DIM:{len(rows_dim)}  ALIAS:{len(rows_alias)}  GEOM:{len(rows_geom)}")
+    print(f"Inserted DIM:{n_dim}  ALIAS:{n_alias}  GEOM:{n_geom}")
 
 if __name__ == "__main__":
     main()
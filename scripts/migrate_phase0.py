@@ -1,5 +1,12 @@
 # /app/scripts/migrate_phase0.py
 import sqlite3, sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+from etl.schema import ensure_pavilion_name_column, ensure_waits_summary, refresh_waits_summary
+from scripts.sqlite_bulk import BULK_PRAGMAS
 
 DB = sys.argv[1] if len(sys.argv)>1 else "data/db/wait_times.db"
 
@@ -25,28 +32,115 @@ WHERE w.wait_min IS NOT NULL
   AND g.geojson IS NOT NULL;
 """
 
-def column_exists(cur, table, col):
-    cur.execute(f"PRAGMA table_info({table})")
-    return any(r[1]==col for r in cur.fetchall())
+def existing_cols(cur, table) -> dict:
+    """列名 → hidden（0: 通常列、2/3: 生成列）。table_info は生成列を返さないので table_xinfo で1回だけ読む"""
+    return {r[1]: r[6] for r in cur.execute(f"PRAGMA table_xinfo({table})")}
+
+# day/hour が無い旧スキーマには VIRTUAL 生成列として追加する（読み出し時に計算されるので既存行の書き換えが要らない）
+# 式は ETL が書き込む値と同じ（day = data_time_jst の先頭10文字、hour = hour_range）
+GENERATED_COLS = {
+    "day": "substr(data_time_jst, 1, 10)",
+    "hour": "hour_range",
+}
+
+# バックフィル対象列ごとの UPDATE と、未設定行だけを持つ部分インデックス
+# 元の値（data_time_jst / hour_range）が NULL の行は埋めようがないので対象外（毎回 '' で書き直さない）
+# 部分インデックスは残しておく。ETL は day/hour を必ず書くので中身はほぼ空のままで、再実行時の件数確認と UPDATE が未設定行だけを見る
+BACKFILL = {
+    "day": ("UPDATE waits_fact SET day  = substr(data_time_jst,1,10) WHERE {pred};",
+            "data_time_jst IS NOT NULL AND (day IS NULL OR day='')",
+            "CREATE INDEX IF NOT EXISTS idx_waits_day_null ON waits_fact(day) WHERE day IS NULL OR day=''"),
+    "hour": ("UPDATE waits_fact SET hour = hour_range WHERE {pred};",
+             "hour_range IS NOT NULL AND (hour IS NULL OR hour='')",
+             "CREATE INDEX IF NOT EXISTS idx_waits_hour_null ON waits_fact(hour) WHERE hour IS NULL OR hour=''"),
+}
+# 列ごとの、その列を含むインデックス（大量に書き換えるときは UPDATE 前に落として後で作り直す）
+INDEX_COLS = {
+    "idx_waits_day_hour": {"day", "hour"},
+    "idx_waits_day_hour_cover": {"day", "hour"},
+    "idx_waits_weekday_hour": {"hour"},
+    "idx_waits_weekday_hour_cover": {"hour"},
+    "idx_waits_day_null": {"day"},
+    "idx_waits_hour_null": {"hour"},
+}
+
+# init_db.py と同じ定義。wait_min IS NOT NULL の部分インデックスで wait_min まで含めてカバリングにする
+# 日×時間帯は旧版 idx_waits_day_hour(day, hour, pavilion_id) と定義が違うので別名で作り、旧版は 3) で落とす
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_waits_day_hour_cover ON waits_fact(day, hour, pavilion_id, wait_min) WHERE wait_min IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_waits_pav_ts ON waits_fact(pavilion_id, timestamp DESC);
+"""
+# 曜日×時間帯は timestamp / pavilion_name まで含めたカバリング版（地図レイヤーの集計も本表を引かない）で旧版を置き換える
+# pavilion_name 列が無い DB（ETL が列を足す前）では旧版のまま
+WEEKDAY_HOUR_COVER = ("CREATE INDEX IF NOT EXISTS idx_waits_weekday_hour_cover ON waits_fact"
+                      "(weekday, hour, pavilion_id, wait_min, timestamp, pavilion_name) WHERE wait_min IS NOT NULL")
+WEEKDAY_HOUR_LEGACY = ("CREATE INDEX IF NOT EXISTS idx_waits_weekday_hour ON waits_fact"
+                       "(weekday, hour, pavilion_id, wait_min) WHERE wait_min IS NOT NULL")
 
 with sqlite3.connect(DB) as conn:
+    # 全行 UPDATE でもページをディスクへ書き戻し続けないよう、WAL + 256MiB のページキャッシュで流す
+    conn.executescript(BULK_PRAGMAS + "PRAGMA cache_size=-262144;")
+    # 0) 表示名 pavilion_name 列と同期トリガー（ETL と同じ処理。ダッシュボードはこの列を前提にする）
+    #    内部で executescript するためトランザクションの外で先に済ませる
+    ensure_pavilion_name_column(conn)
+    conn.commit()
     c = conn.cursor()
-    # 1) waits_fact に day/hour が無ければ追加
-    if not column_exists(c, "waits_fact", "day"):
-        c.execute("ALTER TABLE waits_fact ADD COLUMN day TEXT")
-    if not column_exists(c, "waits_fact", "hour"):
-        c.execute("ALTER TABLE waits_fact ADD COLUMN hour TEXT")
+    c.execute("BEGIN IMMEDIATE;")
+    # 1) waits_fact に day/hour が無ければ生成列として追加
+    cols = existing_cols(c, "waits_fact")
+    for col, expr in GENERATED_COLS.items():
+        if col not in cols:
+            c.execute(f"ALTER TABLE waits_fact ADD COLUMN {col} TEXT GENERATED ALWAYS AS ({expr}) VIRTUAL")
 
-    # 2) 既存データのバックフィル（data_time_jst から day、hour_range から hour）
-    c.execute("UPDATE waits_fact SET day  = substr(coalesce(data_time_jst,''),1,10) WHERE day IS NULL OR day='';")
-    c.execute("UPDATE waits_fact SET hour = hour_range WHERE hour IS NULL OR hour='';")
+    # 2) 既存の通常列として day/hour を持つ DB だけ、未設定の行をバックフィル（生成列は UPDATE できないので対象外）
+    #    （1) で足した列は生成列なので、追加前に読んだ cols の通常列だけ見ればよい）
+    plain = {name for name, hidden in cols.items() if hidden == 0}
+    backfill = {col: BACKFILL[col] for col in BACKFILL if col in plain}
+    # 未設定行の部分インデックスは UPDATE の後（中身がほぼ空になってから）作る。2回目以降は件数確認から使われる
+    pending = {col: c.execute(f"SELECT COUNT(*) FROM waits_fact WHERE {pred}").fetchone()[0]
+               for col, (_, pred, _) in backfill.items()}
+    todo = [col for col, n in pending.items() if n]
+    total = c.execute("SELECT COUNT(*) FROM waits_fact").fetchone()[0]
+    # 表の半分以上を書き換えるときは、更新する列を含むインデックスを先に落とす
+    # （行ごとの B-tree 更新をやめ、UPDATE 後に一括で作り直す。少数行なら作り直しの方が高くつくのでそのまま）
+    if todo and max(pending.values()) * 2 >= total:
+        for idx, idx_cols in INDEX_COLS.items():
+            if idx_cols & set(todo):
+                c.execute(f"DROP INDEX IF EXISTS {idx}")
+    for col in todo:
+        update, pred, _ = backfill[col]
+        c.execute(update.format(pred=pred))
 
-    # 3) インデックス
-    c.execute("CREATE INDEX IF NOT EXISTS idx_waits_day_hour ON waits_fact(day, hour, pavilion_id)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_waits_weekday_hour ON waits_fact(weekday, hour, pavilion_id)")
+    # 3) インデックス（無いものだけ作る）
+    list_indexes = "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='waits_fact'"
+    before = {r[0] for r in c.execute(list_indexes)}
+    for stmt in filter(None, map(str.strip, INDEXES.split(";"))):
+        c.execute(stmt)
+    c.execute("DROP INDEX IF EXISTS idx_waits_day_hour")
+    # 集計をロールアップへ移す前にダッシュボードが作っていたインデックス（今は誰も使わず、挿入のたびに更新だけかかる）
+    for idx in ("ix_waits_day_pav", "ix_waits_day_weekday_hour"):
+        c.execute(f"DROP INDEX IF EXISTS {idx}")
+    if "pavilion_name" in plain:
+        c.execute(WEEKDAY_HOUR_COVER)
+        c.execute("DROP INDEX IF EXISTS idx_waits_weekday_hour")
+    else:
+        c.execute(WEEKDAY_HOUR_LEGACY)
+    for _, _, null_idx in backfill.values():
+        c.execute(null_idx)
+    # 統計の更新（v_waits_for_map / export_map_json のプランに効く）。書き換えた・インデックスを作ったとき、または統計が無いときだけ
+    created = {r[0] for r in c.execute(list_indexes)} - before
+    has_stat = c.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'").fetchone() and \
+        c.execute("SELECT 1 FROM sqlite_stat1 WHERE tbl='waits_fact'").fetchone()
+    if todo or created or not has_stat:
+        c.execute("ANALYZE waits_fact;")
+    conn.commit()
 
     # 4) ビューを再作成（描画対象のみ）
     conn.executescript(DDL_VIEW)
 
+    # 5) ダッシュボード集計用ロールアップ（無ければ作って構築。day/hour を埋め直したときは作り直す）
+    ensure_waits_summary(conn)
+    if todo:
+        refresh_waits_summary(conn)
     conn.commit()
 print(f"migrated: {DB}")
@@ -0,0 +1,38 @@
+# scripts/pavilion_norm.py
+"""
+パビリオン名 → pavilion_id の共通処理（load_master_from_geojson / prepare_pavilion_master で共有）
+- 名前の正規化（normalize_name）。prepare_pavilion_master は同じ処理を列単位で適用している
+- ID は「正規化名のハッシュ（既定 SHA-1）の先頭 N 桁」に pav_ を付けたもの
+- 桁数はスクリプトごとに既存 DB の ID と揃えてある（load_master: 8桁, prepare: 10桁）。変えると ID が変わるので注意
+- ハッシュは config.yaml の PAV_ID_HASH で選ぶ（両スクリプトで同じ値を使うこと）
+"""
+import hashlib
+import unicodedata
+from typing import Iterable
+
+def remove_ws(s: str) -> str:
+    r"""
+    空白をすべて除去する。str.split() の区切りは str.isspace() の文字（正規表現の \s と同じ29文字、全角空白 U+3000 を含む）
+    なので re.sub(r"\s+", "", s) と同じ結果になる。日本語を含む文字列では re.sub や str.translate より速い。
+    normalize_name の結果が ETL 側の \s+ 除去と一致することが alias の前提
+    """
+    return "".join(s.split())
+
+def normalize_name(s: str) -> str:
+    """表記揺れ吸収のための正規化（NFKC → 前後の空白除去 → 空白除去）。文字列以外は "" を返す"""
+    if not isinstance(s, str):
+        return ""
+    return remove_ws(unicodedata.normalize("NFKC", s).strip())
+
+# ID 用のハッシュ。ID は不透明な識別子で暗号強度は要らないので、短い入力で速い blake2s も選べる
+# 既存 DB の ID は sha1 由来なので既定は sha1（切り替えると全 ID が変わる。新規構築の DB 向け）
+PAV_ID_HASHES = {"sha1": hashlib.sha1, "blake2s": hashlib.blake2s}
+DEFAULT_PAV_ID_HASH = "sha1"
+
+def pavilion_ids(norm_names: Iterable[str], digits: int, algo: str = DEFAULT_PAV_ID_HASH) -> list[str]:
+    """正規化済みの名前から pav_ + ハッシュ先頭 digits 桁の ID をまとめて作る（入力と同じ順で返す）"""
+    if algo not in PAV_ID_HASHES:
+        raise ValueError(f"PAV_ID_HASH は {sorted(PAV_ID_HASHES)} のいずれか: {algo!r}")
+    # encode とハッシュを map で一括適用し、名前ごとの Python 側の処理を最小にする
+    digests = map(PAV_ID_HASHES[algo], map(str.encode, norm_names))
+    return ["pav_" + d.hexdigest()[:digits] for d in digests]
@@ -2,93 +2,99 @@
 # -*- coding: utf-8 -*-
 """
 Raw CSV の pavilion_name から、最低限の pavilion_dim / pavilion_alias を初期化するスクリプト。
-- pavilion_id は 正規化名のSHA1から安定生成（pav_XXXXXXXXXX）
+- pavilion_id は 正規化名のSHA1（config の PAV_ID_HASH で変更可）から安定生成（pav_XXXXXXXXXX）
 - alias は「正規化済み表記」をキー（ETLの normalize_name と同じ規則）
 - 既存行は INSERT OR IGNORE で温存
 """
 
-import sqlite3, pandas as pd, re, unicodedata, hashlib, yaml
+import itertools, sqlite3, sys, pandas as pd
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parents[1]  # /app
-CONFIG = ROOT / "etl/config/config.yaml"
+# python scripts/prepare_pavilion_master.py で直接実行した場合も etl パッケージを import できるようにする
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+from etl._config import get_config
+from scripts.pavilion_norm import DEFAULT_PAV_ID_HASH, pavilion_ids, remove_ws
+from scripts.sqlite_bulk import BULK_PRAGMAS, bulk_insert
 
-def normalize_name(s: str) -> str:
-    if not isinstance(s, str): return ""
-    s = unicodedata.normalize("NFKC", s)
-    return re.sub(r"\s+", "", s.strip())
+def pav_ids_from_norms(norms: list[str]) -> list[str]:
+    # pav_ + ハッシュ先頭10桁（全件まとめてハッシュ）
+    return pavilion_ids(norms, 10, get_config().get("PAV_ID_HASH", DEFAULT_PAV_ID_HASH))
 
-def pav_id_from_norm(norm: str) -> str:
-    h = hashlib.sha1(norm.encode("utf-8")).hexdigest()[:10]
-    return f"pav_{h}"
+# 旧スキーマの pavilion_geometry に lon/lat 列を追加し、既存の geojson から埋める
+LONLAT_BACKFILL_SQL = """
+UPDATE pavilion_geometry
+   SET lon = COALESCE(json_extract(geojson, '$.geometry.coordinates[0]'), json_extract(geojson, '$.coordinates[0]')),
+       lat = COALESCE(json_extract(geojson, '$.geometry.coordinates[1]'), json_extract(geojson, '$.coordinates[1]'))
+ WHERE lon IS NULL AND json_valid(geojson);
+"""
+
+# マスタ3表の DDL（PRAGMA foreign_keys は接続ごとの設定なので毎回流す）
+MASTER_DDL = """
+PRAGMA foreign_keys = ON;
+CREATE TABLE IF NOT EXISTS pavilion_dim (
+  pavilion_id TEXT PRIMARY KEY,
+  name_canonical TEXT NOT NULL,
+  area TEXT
+);
+CREATE TABLE IF NOT EXISTS pavilion_alias (
+  alias TEXT PRIMARY KEY,           -- 正規化済み別名（ETLの normalize_name と一致させる）
+  pavilion_id TEXT NOT NULL,
+  FOREIGN KEY (pavilion_id) REFERENCES pavilion_dim(pavilion_id)
+);
+CREATE TABLE IF NOT EXISTS pavilion_geometry (
+  pavilion_id TEXT PRIMARY KEY,
+  geojson TEXT,
+  lon REAL,
+  lat REAL,
+  FOREIGN KEY (pavilion_id) REFERENCES pavilion_dim(pavilion_id)
+);
+"""
+
+def ensure_lonlat_columns(conn: sqlite3.Connection):
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(pavilion_geometry)")}
+    if "lon" in cols and "lat" in cols:
+        return
+    for c in ("lon", "lat"):
+        if c not in cols:
+            conn.execute(f"ALTER TABLE pavilion_geometry ADD COLUMN {c} REAL")
+    conn.execute(LONLAT_BACKFILL_SQL)
 
 def main():
-    with open(CONFIG, "r", encoding="utf-8") as f:
-        cfg = yaml.safe_load(f)
+    cfg = get_config()
     raw_csv = ROOT / cfg["RAW_CSV_PATH"]
     db_path = ROOT / cfg["DB_PATH"]
 
-    df = pd.read_csv(raw_csv, usecols=["pavilion_name"]).dropna()
-    # 全ユニーク表記
-    names = df["pavilion_name"].astype(str).unique().tolist()
+    # category で読み、重複除去を文字列比較ではなく整数コード上で行う（ETL の RAW_CSV_DTYPES と同じ考え方）
+    raw = pd.read_csv(raw_csv, usecols=["pavilion_name"], dtype={"pavilion_name": "category"})["pavilion_name"]
+    # 全ユニーク表記（出現順）
+    names = raw.dropna().drop_duplicates().astype(str)
 
-    # 正規化名 → 代表表記（最初に出たもの）
-    norm_to_repr = {}
-    for name in names:
-        norm = normalize_name(name)
-        if not norm: continue
-        norm_to_repr.setdefault(norm, name)
+    # 正規化名 → 代表表記（最初に出たもの）。pavilion_norm.normalize_name と同じ処理を列単位で一括適用
+    norms = names.str.normalize("NFKC").str.strip().map(remove_ws)
+    first = norms.ne("") & ~norms.duplicated()
+    norm_to_repr = dict(zip(norms[first], names[first]))
 
     print(f"unique names={len(names)}, normalized unique={len(norm_to_repr)}")
 
-    # DDL
-    ddl_dim = """
-    CREATE TABLE IF NOT EXISTS pavilion_dim (
-      pavilion_id TEXT PRIMARY KEY,
-      name_canonical TEXT NOT NULL,
-      area TEXT
-    );
-    """
-    ddl_alias = """
-    CREATE TABLE IF NOT EXISTS pavilion_alias (
-      alias TEXT PRIMARY KEY,           -- 正規化済み別名（ETLの normalize_name と一致させる）
-      pavilion_id TEXT NOT NULL,
-      FOREIGN KEY (pavilion_id) REFERENCES pavilion_dim(pavilion_id)
-    );
-    """
-    ddl_geom = """
-    CREATE TABLE IF NOT EXISTS pavilion_geometry (
-      pavilion_id TEXT PRIMARY KEY,
-      geojson TEXT,
-      FOREIGN KEY (pavilion_id) REFERENCES pavilion_dim(pavilion_id)
-    );
-    """
-
     with sqlite3.connect(str(db_path)) as conn:
-        conn.execute("PRAGMA foreign_keys = ON;")
-        conn.execute(ddl_dim)
-        conn.execute(ddl_alias)
-        conn.execute(ddl_geom)
+        # PRAGMA と3表の DDL を1回の executescript で流す
+        conn.executescript(BULK_PRAGMAS + MASTER_DDL)
+        ensure_lonlat_columns(conn)
+        conn.commit()
 
-        # INSERT OR IGNORE
-        dim_rows = []
-        alias_rows = []
-        for norm, rep in norm_to_repr.items():
-            pid = pav_id_from_norm(norm)
-            dim_rows.append((pid, rep, None))
-            alias_rows.append((norm, pid))
+        # INSERT OR IGNORE（行はリストに溜めず、zip からそのまま流す）
+        pids = pav_ids_from_norms(list(norm_to_repr))
 
-        conn.executemany(
-            "INSERT OR IGNORE INTO pavilion_dim(pavilion_id, name_canonical, area) VALUES (?,?,?)",
-            dim_rows
-        )
-        conn.executemany(
-            "INSERT OR IGNORE INTO pavilion_alias(alias, pavilion_id) VALUES (?,?)",
-            alias_rows
-        )
+        # 2表ぶんを1トランザクションで、複数行 VALUES の INSERT にまとめて投入
+        conn.execute("BEGIN IMMEDIATE;")
+        n_dim = bulk_insert(conn, "INSERT OR IGNORE INTO pavilion_dim(pavilion_id, name_canonical, area)",
+                            zip(pids, norm_to_repr.values(), itertools.repeat(None)))
+        n_alias = bulk_insert(conn, "INSERT OR IGNORE INTO pavilion_alias(alias, pavilion_id)", zip(norm_to_repr, pids))
         conn.commit()
 
-    print(f"inserted (or kept) pavilion_dim={len(dim_rows)}, pavilion_alias={len(alias_rows)}")
+    print(f"inserted (or kept) pavilion_dim={n_dim}, pavilion_alias={n_alias}")
     print(f"DB: {db_path}")
 
 if __name__ == "__main__":
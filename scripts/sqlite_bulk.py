@@ -0,0 +1,34 @@
+# scripts/sqlite_bulk.py
+"""マスタ系スクリプト（load_master_from_geojson / prepare_pavilion_master）共通の一括 INSERT"""
+import itertools
+import sqlite3
+from typing import Iterable
+
+# 一括投入向け PRAGMA（WAL + synchronous=NORMAL ならコミットごとの fsync が不要。mmap で read() の往復も減らす）
+BULK_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+"""
+
+def bulk_insert(conn: sqlite3.Connection, sql_prefix: str, rows: Iterable[tuple], batch: int = 500) -> int:
+    """
+    sql_prefix（"INSERT ... INTO t(c1, c2)"）に VALUES (?,?),(?,?),... を付けて batch 行ずつ1文で INSERT し、投入した行数を返す。
+    executemany の1行1ステップより VM の往復が少ない。トランザクションは呼び出し側で張る。
+    rows はジェネレータでもよい（batch 行ずつ取り出すので、全行をリストに溜めずに流せる）。
+    """
+    it = iter(rows)
+    full_sql = None
+    n = 0
+    while chunk := list(itertools.islice(it, batch)):
+        group = "(" + ",".join("?" * len(chunk[0])) + ")"
+        if len(chunk) == batch:
+            full_sql = full_sql or f"{sql_prefix} VALUES {','.join([group] * batch)}"
+            conn.execute(full_sql, list(itertools.chain.from_iterable(chunk)))
+        else:
+            # batch に満たない残り（マスタ程度の小さな表では全行）は executemany で流す
+            # 行数ぶんの VALUES を持つ1回限りの文をコンパイルするより速い（1行ずつの execute ループはさらに遅い）
+            conn.executemany(f"{sql_prefix} VALUES {group}", chunk)
+        n += len(chunk)
+    return n
@@ -0,0 +1,45 @@
+# tests/test_lttb.py
+# numba 版（_lttb_loop）と NumPy 版（_lttb_numpy）が同じ点を選ぶこと（jit extra の有無で描画が変わらないこと）を確認する
+# _lttb_loop は numba が無くても素の Python 関数として呼べる
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+from dash_app._lttb import _bucket_edges, _lttb_loop, _lttb_numpy, lttb
+
+def _series(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    x = np.arange(n, dtype=np.float64)
+    y = rng.random(n) * 300
+    return x, y
+
+def test_loop_matches_numpy():
+    # n=7919 / 3001, n_out=1500 は以前バケット境界の計算がずれて1点食い違っていた組み合わせ
+    for n, n_out in [(7919, 1500), (3001, 1500), (1000, 3), (1000, 4), (10, 9), (20000, 500)]:
+        x, y = _series(n, seed=n)
+        edges = _bucket_edges(n, n_out)
+        np.testing.assert_array_equal(_lttb_loop(x, y, edges), _lttb_numpy(x, y, edges))
+
+def test_loop_matches_numpy_with_ties():
+    # 待ち時間は5分刻みで同じ値が多い（面積の同点が出やすい）
+    rng = np.random.default_rng(1)
+    x = 1.7e18 + np.sort(rng.integers(0, 10**13, 5000)).astype(np.float64)
+    y = np.round(rng.random(5000) * 30) * 5
+    edges = _bucket_edges(5000, 700)
+    np.testing.assert_array_equal(_lttb_loop(x, y, edges), _lttb_numpy(x, y, edges))
+
+def test_lttb_keeps_endpoints():
+    x, y = _series(1000)
+    idx = lttb(x, y, 100)
+    assert len(idx) == 100
+    assert idx[0] == 0 and idx[-1] == 999
+    assert np.all(np.diff(idx) > 0)
+
+def test_lttb_returns_all_points_when_not_downsampling():
+    x, y = _series(50)
+    np.testing.assert_array_equal(lttb(x, y, 50), np.arange(50))
+    np.testing.assert_array_equal(lttb(x, y, 2), np.arange(50))